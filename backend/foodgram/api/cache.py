@@ -0,0 +1,110 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from recipes.catalog import get_catalog_version
+
+CACHE_HITS_KEY = 'recipes_response_cache_hits'
+CACHE_MISSES_KEY = 'recipes_response_cache_misses'
+RECIPES_CACHE_TIMEOUT = settings.RECIPES_CACHE_TIMEOUT
+
+
+def _count(key):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_cache_stats():
+    hits = cache.get(CACHE_HITS_KEY, 0)
+    misses = cache.get(CACHE_MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'catalog_version': get_catalog_version(),
+    }
+
+
+def normalized_url(request):
+    '''
+    path + sorted query parameters. Empty values are kept: a bare
+    ?cursor= switches the listing to keyset pagination
+    '''
+    params = sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        for value in values
+    )
+    return f'{request.path}?{urlencode(params)}'
+
+
+def get_cache_key(request):
+    digest = hashlib.md5(normalized_url(request).encode()).hexdigest()
+    return f'recipes_response:{get_catalog_version()}:{digest}'
+
+
+def make_etag(*parts):
+    raw = ':'.join(str(part) for part in parts)
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def conditional_response(view_method, request, *args, etag=None,
+                         last_modified=None, **kwargs):
+    '''
+    Answer 304 Not Modified when the client validators match,
+    without calling the view (and its serializers) at all
+    '''
+    if last_modified is not None:
+        last_modified = int(last_modified.timestamp())
+    not_modified = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=last_modified
+    )
+    if not_modified is None:
+        response = view_method(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+    else:
+        response = not_modified
+    if etag:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ('Authorization', ))
+    return response
+
+
+def cached_anonymous_response(view_method, request, *args, **kwargs):
+    '''
+    Serve anonymous GET responses of the recipe catalog from the cache.
+    Entries are keyed on the catalog version, so any catalog change
+    makes them unreachable
+    '''
+    if request.method != 'GET' or request.user.is_authenticated:
+        return view_method(request, *args, **kwargs)
+    key = get_cache_key(request)
+    cached = cache.get(key)
+    if cached is not None:
+        _count(CACHE_HITS_KEY)
+        data, status = cached
+        response = Response(data, status=status)
+        response['X-Cache'] = 'HIT'
+        return response
+    _count(CACHE_MISSES_KEY)
+    response = view_method(request, *args, **kwargs)
+    if response.status_code == 200:
+        cache.set(
+            key,
+            (response.data, response.status_code),
+            RECIPES_CACHE_TIMEOUT
+        )
+    response['X-Cache'] = 'MISS'
+    return response
@@ -1,6 +1,15 @@
-from django_filters.rest_framework import filters, FilterSet
+from django.db.models import Exists, OuterRef
+from django_filters.rest_framework import (
+    DjangoFilterBackend, filters, FilterSet
+)
 
-from recipes.models import Recipe, Ingredient, Tag
+from recipes.indexes import RecipeIdList, recipe_index
+from recipes.models import Recipe, Ingredient, RecipeToTag
+from recipes.registry import reference_registry
+from recipes.search import search_recipes
+from api.paginators import CustomPageNumberPaginator
+
+INDEXED_FILTERS = ('author', 'tags')
 
 
 class RecipeFilter(FilterSet):
@@ -8,11 +17,15 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
+    tags = filters.MultipleChoiceFilter(
+        choices=reference_registry.get_tag_choices,
+        method='filter_tags'
     )
+    search = filters.CharFilter(method='filter_search')
+
+    def __init__(self, *args, use_index=False, **kwargs):
+        self.use_index = use_index
+        super().__init__(*args, **kwargs)
 
     def _filter_universal(self, queryset, value, filter_parameters):
         if value and self.request.user.is_authenticated:
@@ -27,12 +40,62 @@ class RecipeFilter(FilterSet):
         filter_parameters = {'shoppingcarts_recipe__user': self.request.user}
         return self._filter_universal(queryset, value, filter_parameters)
 
-    # def filter_tags(self, queryset, name, value):
-    #     return queryset.filter(tags__slug__in=value).distinct()
+    def filter_tags(self, queryset, name, value):
+        tag_ids = reference_registry.get_tag_ids(value)
+        return queryset.filter(Exists(RecipeToTag.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=tag_ids
+        )))
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def _use_index(self):
+        ''' page number listing filtered only by tags and / or author '''
+        data = self.form.cleaned_data
+        return bool(
+            self.use_index
+            and any(data.get(name) for name in INDEXED_FILTERS)
+            and not any(
+                value for name, value in data.items()
+                if name not in INDEXED_FILTERS
+            )
+            and self.request.method == 'GET'
+            and CustomPageNumberPaginator.cursor_query_param
+            not in self.request.query_params
+        )
+
+    def filter_queryset(self, queryset):
+        '''
+        Tags / author are answered by the bitmap index, only the
+        recipes of the requested page are loaded
+        '''
+        if not self._use_index():
+            return super().filter_queryset(queryset)
+        author = self.form.cleaned_data.get('author')
+        ids = recipe_index.select(
+            tag_ids=reference_registry.get_tag_ids(
+                self.form.cleaned_data.get('tags') or []
+            ),
+            author_id=author.id if author else None,
+        )
+        return RecipeIdList(ids, queryset)
 
     class Meta:
         model = Recipe
-        fields = ('author', 'is_favorited', 'is_in_shopping_cart', 'tags')
+        fields = (
+            'author', 'is_favorited', 'is_in_shopping_cart', 'tags', 'search'
+        )
+
+
+class RecipeFilterBackend(DjangoFilterBackend):
+    '''
+    Only the list action may be answered by the bitmap index, detail
+    actions look the recipe up in the filtered queryset
+    '''
+    def get_filterset_kwargs(self, request, queryset, view):
+        kwargs = super().get_filterset_kwargs(request, queryset, view)
+        kwargs['use_index'] = view.action == 'list'
+        return kwargs
 
 
 class IngrigientFilter(FilterSet):
@@ -1,5 +1,35 @@
-from rest_framework.pagination import PageNumberPagination
+from django.db.models import QuerySet
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CustomCursorPaginator(CursorPagination):
+    ordering = '-id'
+    page_size_query_param = 'limit'
 
 
 class CustomPageNumberPaginator(PageNumberPagination):
+    '''
+    Page number pagination (?page=&limit=) with an opt-in keyset mode:
+    passing ?cursor= (empty for the first page) switches to
+    CustomCursorPaginator, which returns opaque next/previous cursors
+    and skips the COUNT(*) query and OFFSET scans
+    '''
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (
+            self.cursor_query_param in request.query_params
+            and isinstance(queryset, QuerySet)
+        ):
+            self.cursor_paginator = CustomCursorPaginator()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,29 @@
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+
+class MultiPartJSONParser(MultiPartParser):
+    '''
+    multipart/form-data with the image sent as a file part (no base64
+    overhead). Nested fields listed in view.multipart_json_fields are
+    sent as JSON strings, e.g. ingredients='[{"id": 1, "amount": 10}]'
+    '''
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parsed = super().parse(stream, media_type, parser_context)
+        view = (parser_context or {}).get('view')
+        json_fields = getattr(view, 'multipart_json_fields', ())
+        data = {}
+        for key in parsed.data:
+            value = parsed.data[key]
+            if key in json_fields:
+                try:
+                    value = json.loads(value)
+                except ValueError as error:
+                    raise ParseError(f'{key}: JSON parse error - {error}')
+            data[key] = value
+        # plain dicts: request.data merges files with dict.update(),
+        # which would copy the raw value lists of a MultiValueDict
+        return DataAndFiles(data, dict(parsed.files.items()))
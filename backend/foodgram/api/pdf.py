@@ -0,0 +1,73 @@
+import os
+from pathlib import Path
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+# no models here: the module is imported by the render worker processes
+
+PDF_FORNT = settings.PDF_FONTS_FILE
+PDF_FONTS_FONTSIZE = settings.PDF_FONTS_FONTSIZE
+PDF_FORNT_NAME = PDF_FORNT.split('.')[0]
+PDF_FONTS_DIR = str(Path(__file__).resolve().parent) + '/fonts'
+
+PDF_TITLE = 'Список покупок:'
+PDF_TITLE_X = 200
+PDF_TEXT_X = 100
+PDF_TOP_Y = 800
+PDF_BOTTOM_Y = 40
+PDF_LINE_HEIGHT = 20
+
+
+def register_pdf_font():
+    '''
+    Parse and register the TTF font once per process (called from
+    ApiConfig.ready). ReportLab embeds only the used glyphs (subset)
+    '''
+    if PDF_FORNT_NAME in pdfmetrics.getRegisteredFontNames():
+        return
+    pdfmetrics.registerFont(
+        TTFont(PDF_FORNT_NAME, str(Path(PDF_FONTS_DIR) / PDF_FORNT))
+    )
+
+
+def _new_page(page):
+    page.showPage()
+    page.setFont(PDF_FORNT_NAME, PDF_FONTS_FONTSIZE)
+    return PDF_TOP_Y
+
+
+def write_pdf(shopping_list, file):
+    ''' lay the shopping list out over as many A4 pages as needed '''
+    register_pdf_font()
+    page = canvas.Canvas(file, pagesize=A4, pageCompression=1)
+    page.setFont(PDF_FORNT_NAME, PDF_FONTS_FONTSIZE)
+    y_coordinate = PDF_TOP_Y
+    page.drawString(PDF_TITLE_X, y_coordinate, PDF_TITLE)
+    text_width = A4[0] - 2 * PDF_TEXT_X
+    for item in shopping_list:
+        for line in simpleSplit(
+            item, PDF_FORNT_NAME, PDF_FONTS_FONTSIZE, text_width
+        ):
+            y_coordinate -= PDF_LINE_HEIGHT
+            if y_coordinate < PDF_BOTTOM_Y:
+                y_coordinate = _new_page(page)
+            page.drawString(PDF_TEXT_X, y_coordinate, line)
+    page.showPage()
+    page.save()
+
+
+def render_pdf_file(shopping_list, path):
+    '''
+    Render worker entry point. Writes into a temporary file next to
+    the target and renames it, so an existing path is always complete
+    '''
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as file:
+        write_pdf(shopping_list, file)
+    os.replace(tmp_path, path)
+    return path
@@ -1,7 +1,14 @@
+from django.db import transaction
 from rest_framework import serializers
 
 from recipes.models import Ingredient, Recipe, RecipeToIngredient, Tag
-from users.serializers import CustomUserSerializer, Base64ImageField
+from recipes.registry import reference_registry
+from recipes.services import (
+    refresh_recipe_carts, sync_recipe_ingredients, sync_recipe_tags
+)
+from users.serializers import (
+    CustomUserSerializer, Base64ImageField, ImageVariantField
+)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -17,10 +24,13 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 
 class RecipeClassicSerializer(serializers.ModelSerializer):
+    thumbnail = ImageVariantField('thumbnail')
+    srcset = ImageVariantField('srcset')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time', )
+        fields = ('id', 'name', 'image', 'thumbnail', 'srcset',
+                  'cooking_time', )
         read_only_fields = ('id', 'name', 'image', 'cooking_time', )
 
 
@@ -32,10 +42,85 @@ class RecipeShoppingcartSerializer(RecipeClassicSerializer):
     pass
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False
+    )
+
+
+class PantrySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+
+class BatchedSlugRelatedField(serializers.SlugRelatedField):
+    '''
+    The value is only type checked here, the parent serializer
+    resolves all values of the request with one query
+    '''
+    def to_internal_value(self, data):
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail('invalid')
+
+    def to_representation(self, value):
+        return value
+
+
+class BatchedPrimaryKeyRelatedField(serializers.ManyRelatedField):
+    '''
+    PrimaryKeyRelatedField(many=True) resolved with one id__in query,
+    every missing or duplicate pk is reported in one error
+    '''
+    default_error_messages = {
+        'duplicate': 'Duplicate pk "{pk_value}".',
+    }
+
+    def __init__(self, queryset, **kwargs):
+        kwargs['child_relation'] = serializers.PrimaryKeyRelatedField(
+            queryset=queryset
+        )
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        pks = []
+        for item in data:
+            try:
+                pks.append(int(item))
+            except (TypeError, ValueError):
+                child.fail('incorrect_type', data_type=type(item).__name__)
+        objects = child.get_queryset().in_bulk(pks)
+        errors = []
+        seen = set()
+        for pk in pks:
+            if pk not in objects:
+                errors.append(child.error_messages['does_not_exist'].format(
+                    pk_value=pk
+                ))
+            elif pk in seen:
+                errors.append(self.error_messages['duplicate'].format(
+                    pk_value=pk
+                ))
+            seen.add(pk)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return [objects[pk] for pk in pks]
+
+
 class RecipeToIngredientSerializer(serializers.ModelSerializer):
-    id = serializers.SlugRelatedField(
+    id = BatchedSlugRelatedField(
         slug_field='id',
-        source='ingredient',
+        source='ingredient_id',
         queryset=Ingredient.objects.all()
     )
     name = serializers.SlugRelatedField(
@@ -55,13 +140,26 @@ class RecipeToIngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('name', 'measurement_unit')
 
 
+class RecipeToIngredientReadSerializer(serializers.BaseSerializer):
+    ''' ingredient metadata comes from the reference registry '''
+
+    def to_representation(self, instance):
+        ingredient = reference_registry.get_data(
+            self.context.get('request')
+        ).get_ingredient(instance.ingredient_id)
+        ingredient['amount'] = instance.amount
+        return ingredient
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     image = Base64ImageField(required=True, allow_null=False)
-    tags = TagSerializer(required=True, many=True)
+    thumbnail = ImageVariantField('thumbnail')
+    srcset = ImageVariantField('srcset')
+    tags = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     author = CustomUserSerializer(many=False, read_only=True)
-    ingredients = RecipeToIngredientSerializer(
+    ingredients = RecipeToIngredientReadSerializer(
         many=True,
         source='recipe_ingridients'
     )
@@ -69,7 +167,8 @@ class RecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
         fields = ('id', 'author', 'tags', 'ingredients',
-                  'name', 'image', 'text', 'cooking_time',
+                  'name', 'image', 'thumbnail', 'srcset', 'text',
+                  'cooking_time',
                   'is_favorited', 'is_in_shopping_cart', )
         read_only_fields = ('id', 'author', 'is_favorited',
                             'is_in_shopping_cart', )
@@ -81,28 +180,36 @@ class RecipeSerializer(serializers.ModelSerializer):
             return False
         return user
 
-    def _check_existing_obj(self, name, filter_parameters):
+    def _check_existing_obj(self, obj, name, related_name):
+        if hasattr(obj, name):
+            return getattr(obj, name)
         user = self._check_user()
         if not user:
             return False
-        return getattr(user, name).filter(**filter_parameters).exists()
+        return getattr(user, related_name).filter(recipe=obj).exists()
+
+    def get_tags(self, obj):
+        reference_data = reference_registry.get_data(
+            self.context.get('request')
+        )
+        return [
+            reference_data.get_tag(recipe_tag.tag_id)
+            for recipe_tag in obj.recipetotag_set.all()
+        ]
 
     def get_is_favorited(self, obj):
-        name = 'favorites'
-        filter_parameters = {'recipe': obj}
-        return self._check_existing_obj(name, filter_parameters)
+        return self._check_existing_obj(obj, 'is_favorited', 'favorites')
 
     def get_is_in_shopping_cart(self, obj):
-        name = 'shoppingcarts'
-        filter_parameters = {'recipe': obj}
-        return self._check_existing_obj(name, filter_parameters)
+        return self._check_existing_obj(
+            obj,
+            'is_in_shopping_cart',
+            'shoppingcarts'
+        )
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True
-    )
+    tags = BatchedPrimaryKeyRelatedField(queryset=Tag.objects.all())
     ingredients = RecipeToIngredientSerializer(many=True)
     image = Base64ImageField(required=True)
 
@@ -112,12 +219,40 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                   'name', 'text', 'cooking_time', )
         read_only_fields = ('author',)
 
+    def validate_ingredients(self, value):
+        ''' all ingredient ids of the recipe are checked with one query '''
+        id_field = self.fields['ingredients'].child.fields['id']
+        ids = [item['ingredient_id'] for item in value]
+        existing = set(
+            Ingredient.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        errors = []
+        seen = set()
+        for ingredient_id in ids:
+            if ingredient_id not in existing:
+                message = id_field.error_messages['does_not_exist'].format(
+                    slug_name=id_field.slug_field, value=ingredient_id
+                )
+            elif ingredient_id in seen:
+                message = (
+                    f'Duplicate object with {id_field.slug_field}='
+                    f'{ingredient_id}.'
+                )
+            else:
+                message = None
+            errors.append({'id': [message]} if message else {})
+            seen.add(ingredient_id)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return value
+
     def create_ingredients(self, ingredients, recipe):
         for i in range(len(ingredients)):
             ingredients[i]['recipe'] = recipe
             ingredients[i] = RecipeToIngredient(**ingredients[i])
         RecipeToIngredient.objects.bulk_create(ingredients)
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
@@ -126,15 +261,24 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         self.create_ingredients(ingredients, recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
+        ''' relations are updated by delta, saving the recipe touches it '''
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
+        amounts = {
+            item['ingredient_id']: item['amount'] for item in ingredients
+        }
         super().update(instance, validated_data)
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.create_ingredients(ingredients, instance)
+        sync_recipe_tags(instance, [tag.id for tag in tags])
+        if sync_recipe_ingredients(instance, amounts):
+            refresh_recipe_carts(instance.id)
 
         return instance
 
     def to_representation(self, instance):
+        user = self.context.get('request').user
+        instance = Recipe.objects.with_related().with_user_flags(
+            user
+        ).get(pk=instance.pk)
         return RecipeSerializer(instance, context=self.context).data
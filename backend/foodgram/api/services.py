@@ -0,0 +1,22 @@
+from recipes.models import ShoppingCartTotal
+
+SHOPPING_LIST_FIELDS = ('name', 'measurement_unit', 'amount')
+
+
+def get_shopping_list(user):
+    '''
+    Ingredient totals of the user's shopping cart: rows of name,
+    measurement_unit, amount sorted by name and unit, read from the
+    materialized ShoppingCartTotal table (one indexed lookup).
+    The same name with different units stays on separate rows
+    '''
+    return ShoppingCartTotal.objects.filter(
+        user=user
+    ).order_by(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+    ).values_list(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'amount',
+    )
@@ -0,0 +1,300 @@
+import tempfile
+from concurrent.futures import Future
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError
+from rest_framework.test import APITestCase
+
+from recipes.catalog import bump_reference_version
+from recipes.indexes import RecipeBitmapIndex
+from recipes.models import Recipe, ShoppingCart, Tag
+
+User = get_user_model()
+
+
+class RecipeIndexFilterTests(APITestCase):
+    ''' tag / author filters answered by the bitmap index '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.other = (
+            User.objects.create_user(
+                username=username,
+                email=f'{username}@example.com',
+                password='password',
+                first_name='Имя',
+                last_name='Фамилия',
+            )
+            for username in ('author', 'other')
+        )
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        cls.recipes = []
+        for author in (cls.author, cls.other, cls.author):
+            recipe = Recipe.objects.create(
+                author=author,
+                name='Рецепт',
+                image='ingridients/test.png',
+                text='Текст',
+                cooking_time=5,
+            )
+            recipe.tags.set([cls.tag])
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.index = RecipeBitmapIndex()
+        patcher = mock.patch('api.filters.recipe_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get_ids(self, response):
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_list_by_author_uses_index(self):
+        with mock.patch.object(
+            self.index, 'select', wraps=self.index.select
+        ) as select:
+            response = self.client.get(
+                '/api/recipes/', {'author': self.author.id}
+            )
+        self.assertEqual(response.status_code, 200)
+        select.assert_called_once()
+        self.assertEqual(
+            self._get_ids(response),
+            [self.recipes[2].id, self.recipes[0].id]
+        )
+
+    def test_list_by_tags_and_author_uses_index(self):
+        with mock.patch.object(
+            self.index, 'select', wraps=self.index.select
+        ) as select:
+            response = self.client.get(
+                '/api/recipes/',
+                {'tags': self.tag.slug, 'author': self.other.id}
+            )
+        self.assertEqual(response.status_code, 200)
+        select.assert_called_once()
+        self.assertEqual(self._get_ids(response), [self.recipes[1].id])
+
+    def test_list_picks_up_recipes_written_by_another_process(self):
+        # authenticated: the response is not cached by catalog version
+        self.client.force_authenticate(self.author)
+        self.client.get('/api/recipes/', {'author': self.other.id})
+        # bulk_create sends no signals: the catalog version is not bumped
+        Recipe.objects.bulk_create([Recipe(
+            author=self.other,
+            name='Импорт',
+            image='ingridients/test.png',
+            text='Текст',
+            cooking_time=5,
+        )])
+        recipe = Recipe.objects.latest('id')
+        with mock.patch('recipes.catalog.CATALOG_DB_CHECK_INTERVAL', 0):
+            response = self.client.get(
+                '/api/recipes/', {'author': self.other.id}
+            )
+        self.assertEqual(
+            self._get_ids(response), [recipe.id, self.recipes[1].id]
+        )
+
+    def test_retrieve_with_author_filter(self):
+        recipe = self.recipes[0]
+        with mock.patch.object(self.index, 'select') as select:
+            response = self.client.get(
+                f'/api/recipes/{recipe.id}/', {'author': self.author.id}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], recipe.id)
+        select.assert_not_called()
+
+    def test_retrieve_with_tags_filter(self):
+        recipe = self.recipes[1]
+        response = self.client.get(
+            f'/api/recipes/{recipe.id}/', {'tags': self.tag.slug}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], recipe.id)
+
+    def test_retrieve_filtered_out_by_author(self):
+        response = self.client.get(
+            f'/api/recipes/{self.recipes[1].id}/', {'author': self.author.id}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class AnonymousResponseCacheTests(APITestCase):
+    ''' cached anonymous recipe listings '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            password='password',
+            first_name='Имя',
+            last_name='Фамилия',
+        )
+        Recipe.objects.create(
+            author=cls.author,
+            name='Рецепт',
+            image='ingridients/test.png',
+            text='Текст',
+            cooking_time=5,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cursor_and_page_number_listings_cached_apart(self):
+        for first, second in (('?cursor=', ''), ('', '?cursor=')):
+            with self.subTest(first=first, second=second):
+                cache.clear()
+                self.client.get(f'/api/recipes/{first}')
+                response = self.client.get(f'/api/recipes/{second}')
+                self.assertEqual(response['X-Cache'], 'MISS')
+                self.assertEqual('count' in response.data, not second)
+
+    def test_repeated_listing_is_cached(self):
+        self.client.get('/api/recipes/', {'cursor': ''})
+        response = self.client.get('/api/recipes/', {'cursor': ''})
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertNotIn('count', response.data)
+
+
+class RecipeSearchTests(APITestCase):
+    ''' full text ?search= on names and texts '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            password='password',
+            first_name='Имя',
+            last_name='Фамилия',
+        )
+        cls.tag = Tag.objects.create(
+            name='Обед', color='#49B64E', slug='lunch'
+        )
+        cls.in_text, cls.in_name, cls.other = (
+            Recipe.objects.create(
+                author=cls.author,
+                name=name,
+                image='ingridients/test.png',
+                text=text,
+                cooking_time=5,
+            )
+            for name, text in (
+                ('Салат', 'Подавать с борщом'),
+                ('Борщ', 'Свекла и капуста'),
+                ('Каша', 'Крупа и молоко'),
+            )
+        )
+        cls.in_text.tags.set([cls.tag])
+
+    def setUp(self):
+        # the tag is created in a transaction that is never committed
+        bump_reference_version()
+
+    def _search(self, params):
+        response = self.client.get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['count'], [
+            recipe['id'] for recipe in response.data['results']
+        ]
+
+    def test_name_matches_first(self):
+        self.assertEqual(
+            self._search({'search': 'борщ'}),
+            (2, [self.in_name.id, self.in_text.id])
+        )
+
+    def test_search_with_tags(self):
+        self.assertEqual(
+            self._search({'search': 'бор', 'tags': self.tag.slug}),
+            (1, [self.in_text.id])
+        )
+
+
+class ShoppingCartActionTests(APITestCase):
+    ''' POST / DELETE /api/recipes/{id}/shopping_cart/ '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user',
+            email='user@example.com',
+            password='password',
+            first_name='Имя',
+            last_name='Фамилия',
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user,
+            name='Рецепт',
+            image='ingridients/test.png',
+            text='Текст',
+            cooking_time=5,
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/recipes/{self.recipe.id}/shopping_cart/'
+
+    def test_add_twice(self):
+        self.assertEqual(self.client.post(self.url).status_code, 200)
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data, {'errors': 'Recipes is already in shopping_cart'}
+        )
+
+    def test_totals_integrity_error_is_not_reported_as_duplicate(self):
+        with mock.patch(
+            'recipes.signals.add_recipe_to_totals',
+            side_effect=IntegrityError('unique_user_ingredient_total')
+        ):
+            with self.assertRaises(IntegrityError):
+                self.client.post(self.url)
+        self.assertFalse(ShoppingCart.objects.exists())
+
+
+class ShoppingCartPdfTests(APITestCase):
+    ''' pdf of the cart rendered off the request path '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user',
+            email='user@example.com',
+            password='password',
+            first_name='Имя',
+            last_name='Фамилия',
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        for patcher in (
+            mock.patch('api.utils.PDF_CACHE_DIR', Path(cache_dir.name)),
+            mock.patch('api.utils.PDF_RENDER_TIMEOUT', 0.1),
+            # a render that never finishes
+            mock.patch('api.utils.render_pdf_async', return_value=Future()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_slow_render_answers_202_by_default(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': 'pdf'}
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(
+            response['Location'],
+            '/api/recipes/download_shopping_cart/?format=pdf'
+        )
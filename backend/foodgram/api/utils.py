@@ -1,63 +1,225 @@
-import io
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import lru_cache
 from pathlib import Path
 
 from django.conf import settings
-from django.http import FileResponse
-from reportlab import rl_config
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfgen import canvas
+from django.http import (
+    FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+)
 
-from api.serializers import RecipeSerializer
-from recipes.models import Recipe
+from api.pdf import (
+    PDF_FONTS_FONTSIZE, PDF_FORNT, PDF_TITLE, render_pdf_file
+)
+from api.services import SHOPPING_LIST_FIELDS, get_shopping_list
 
 
-PDF_FORNT = settings.PDF_FONTS_FILE
-PDF_FONTS_FONTSIZE = settings.PDF_FONTS_FONTSIZE
-PDF_FORNT_NAME = PDF_FORNT.split('.')[0]
-PDF_FONTS_DIR = str(Path(__file__).resolve().parent) + '/fonts'
 PDF_GENERATED_FILENAME = settings.PDF_GENERATED_FILENAME
+PDF_CACHE_DIR = Path(settings.PDF_CACHE_DIR)
+PDF_CACHE_MAX_AGE = settings.PDF_CACHE_MAX_AGE
+PDF_RENDER_WORKERS = settings.PDF_RENDER_WORKERS
+PDF_RENDER_TIMEOUT = settings.PDF_RENDER_TIMEOUT
+PDF_ACCEL_REDIRECT_PREFIX = settings.PDF_ACCEL_REDIRECT_PREFIX
+PDF_RETRY_AFTER = 1
+EXPORT_FILENAME = Path(PDF_GENERATED_FILENAME).stem
+EXPORT_CONTENT_TYPES = {
+    'txt': 'text/plain; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+}
+
+_pending_lock = threading.Lock()
+_pending_renders = {}
 
 
 def get_ingredients_for_pfd(request):
-    recipes = Recipe.objects.filter(shoppingcarts_recipe__user=request.user)
-    context = {'request': request}
-    serialiser = RecipeSerializer(instance=recipes, many=True, context=context)
-
-    ingredient_list = {}
-    for recipe in serialiser.data:
-        for ingredient in recipe['ingredients']:
-            name = ingredient['name']
-            amount = ingredient['amount']
-            measurement_unit = ingredient['measurement_unit']
-            if name in ingredient_list:
-                ingredient_list[name][0] += amount
-            else:
-                ingredient_list[name] = [amount, measurement_unit]
-    shopping_list = []
-    for key, value in ingredient_list.items():
-        shopping_list.append(f'{key} ({value[1]}) - {value[0]}')
-    return shopping_list
+    return [
+        f'{name} ({measurement_unit}) - {amount}'
+        for name, measurement_unit, amount in get_shopping_list(request.user)
+    ]
 
 
-def generate_pdf(request):
-    rl_config.TTFSearchPath.append(PDF_FONTS_DIR)
-    shopping_list = get_ingredients_for_pfd(request)
-    buffer = io.BytesIO()
-    page = canvas.Canvas(buffer, pagesize=A4)
-    pdfmetrics.registerFont(TTFont(PDF_FORNT_NAME, PDF_FORNT))
-    page.setFont(PDF_FORNT_NAME, PDF_FONTS_FONTSIZE)
-    y_coordinate = 800
-    page.drawString(200, y_coordinate, "Список покупок:")
-    for item in shopping_list:
-        y_coordinate -= 20
-        page.drawString(100, y_coordinate, item)
-    page.showPage()
-    page.save()
-    buffer.seek(0)
+def get_pdf_path(shopping_list):
+    ''' cached artifact path: hash of the cart contents and pdf settings '''
+    raw = json.dumps(
+        [PDF_FORNT, PDF_FONTS_FONTSIZE, shopping_list],
+        ensure_ascii=False
+    )
+    digest = hashlib.sha256(raw.encode()).hexdigest()
+    return PDF_CACHE_DIR / f'{digest}.pdf'
+
+
+@lru_cache(maxsize=None)
+def _get_executor():
+    '''
+    bounded pool, created lazily in each web worker process,
+    started from a fork server like the image variants pool
+    '''
+    return ProcessPoolExecutor(
+        max_workers=PDF_RENDER_WORKERS,
+        mp_context=multiprocessing.get_context('forkserver')
+    )
+
+
+def _prune_pdf_cache():
+    expired = time.time() - PDF_CACHE_MAX_AGE
+    for path in PDF_CACHE_DIR.glob('*.pdf'):
+        try:
+            if path.stat().st_mtime < expired:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def render_pdf_async(shopping_list, path):
+    '''
+    Submit rendering to the process pool, concurrent requests for
+    the same cart share one render
+    '''
+    key = str(path)
+    PDF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _prune_pdf_cache()
+    with _pending_lock:
+        future = _pending_renders.get(key)
+        if future is not None:
+            return future
+        try:
+            future = _get_executor().submit(
+                render_pdf_file, shopping_list, key
+            )
+        except RuntimeError:
+            # broken pool (a worker died), start a new one
+            _get_executor.cache_clear()
+            future = _get_executor().submit(
+                render_pdf_file, shopping_list, key
+            )
+        _pending_renders[key] = future
+    future.add_done_callback(
+        lambda done: _pending_renders.pop(key, None)
+    )
+    return future
+
+
+def serve_pdf(path):
+    '''
+    Response with a cached pdf, None when the file was pruned
+    after the existence check
+    '''
+    try:
+        os.utime(path)
+        if not PDF_ACCEL_REDIRECT_PREFIX:
+            file = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    if PDF_ACCEL_REDIRECT_PREFIX:
+        response = HttpResponse(content_type='application/pdf')
+        response['X-Accel-Redirect'] = PDF_ACCEL_REDIRECT_PREFIX + path.name
+        response['Content-Disposition'] = (
+            f'attachment; filename="{PDF_GENERATED_FILENAME}"'
+        )
+        return response
     return FileResponse(
-        buffer,
+        file,
         as_attachment=True,
-        filename=PDF_GENERATED_FILENAME
+        filename=PDF_GENERATED_FILENAME,
+        content_type='application/pdf'
+    )
+
+
+def pdf_in_progress(request):
+    response = JsonResponse({'status': 'processing'}, status=202)
+    response['Location'] = request.get_full_path()
+    response['Retry-After'] = PDF_RETRY_AFTER
+    return response
+
+
+def wants_async(request):
+    return (
+        request.query_params.get('async') in ('1', 'true')
+        or 'respond-async' in request.headers.get('Prefer', '')
+    )
+
+
+def generate_pdf(request):
+    '''
+    Serve the pdf of the current cart from the artifact cache.
+    A changed cart is rendered in the process pool. The request
+    waits at most PDF_RENDER_TIMEOUT (a second by default), so small
+    carts still download at once, then answers 202 and the client polls
+    the same url. With ?async=1 or Prefer: respond-async it answers
+    202 right away
+    '''
+    shopping_list = get_ingredients_for_pfd(request)
+    path = get_pdf_path(shopping_list)
+    response = serve_pdf(path)
+    if response is not None:
+        return response
+    future = render_pdf_async(shopping_list, path)
+    if wants_async(request):
+        return pdf_in_progress(request)
+    try:
+        future.result(timeout=PDF_RENDER_TIMEOUT)
+    except FutureTimeoutError:
+        return pdf_in_progress(request)
+    return serve_pdf(path) or pdf_in_progress(request)
+
+
+class Echo:
+    ''' file-like object for csv.writer, returns the written line '''
+
+    def write(self, value):
+        return value
+
+
+def iter_txt(rows):
+    yield f'{PDF_TITLE}\n'
+    for name, measurement_unit, amount in rows:
+        yield f'{name} ({measurement_unit}) - {amount}\n'
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(SHOPPING_LIST_FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_json(rows):
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps(
+            dict(zip(SHOPPING_LIST_FIELDS, row)), ensure_ascii=False
+        )
+        separator = ','
+    yield ']'
+
+
+EXPORT_GENERATORS = {
+    'txt': iter_txt,
+    'csv': iter_csv,
+    'json': iter_json,
+}
+
+
+def stream_shopping_list(request, export_format):
+    '''
+    Stream the aggregated shopping list as text, csv or json rows
+    straight from the database cursor, bypassing reportlab
+    '''
+    rows = get_shopping_list(request.user).iterator()
+    response = StreamingHttpResponse(
+        EXPORT_GENERATORS[export_format](rows),
+        content_type=EXPORT_CONTENT_TYPES[export_format]
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{EXPORT_FILENAME}.{export_format}"'
     )
+    return response
@@ -1,29 +1,73 @@
+from functools import partial
+
+from django.db import transaction
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
-from rest_framework.decorators import action, api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.decorators import (
+    action, api_view, permission_classes, renderer_classes
+)
+from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import (
+    AllowAny, IsAdminUser, IsAuthenticated
+)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
+from recipes.catalog import get_reference_version
+from recipes.indexes import RecipeIdList, ingredient_index, pantry_index
 from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
-from api.filters import RecipeFilter, IngrigientFilter
+from recipes.services import rebuild_cart_totals, remove_recipe_from_totals
+from api.cache import (
+    cached_anonymous_response, conditional_response,
+    get_cache_stats, make_etag, normalized_url
+)
+from api.filters import IngrigientFilter, RecipeFilter, RecipeFilterBackend
+from api.paginators import CustomCursorPaginator
+from api.parsers import MultiPartJSONParser
 from api.permissions import IsAuthor
+from api.renderers import CSVRenderer, PDFRenderer, PlainTextRenderer
+from api.services import SHOPPING_LIST_FIELDS, get_shopping_list
 from api.serializers import (
-    FavoriteSerializer, IngredientSerializer,
-    RecipeSerializer, RecipeWriteSerializer,
+    FavoriteSerializer, IngredientSerializer, PantrySerializer,
+    RecipeIdsSerializer, RecipeSerializer, RecipeWriteSerializer,
     RecipeShoppingcartSerializer, TagSerializer
 )
-from api.utils import generate_pdf
+from api.utils import generate_pdf, stream_shopping_list
+from users.utils import get_subscription_ids
+
+
+class ReferenceConditionalViewSet(ReadOnlyModelViewSet):
+    '''
+    Tags and ingredients change rarely: ETag is derived from
+    the reference data version and the requested url
+    '''
+
+    def _get_etag(self, request):
+        return make_etag(normalized_url(request), get_reference_version())
+
+    def list(self, request, *args, **kwargs):
+        return conditional_response(
+            super().list, request, *args,
+            etag=self._get_etag(request), **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_response(
+            super().retrieve, request, *args,
+            etag=self._get_etag(request), **kwargs
+        )
 
 
-class TagsViewSet(ReadOnlyModelViewSet):
+class TagsViewSet(ReferenceConditionalViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [AllowAny, ]
     pagination_class = None
 
 
-class IngredientVieWSet(ReadOnlyModelViewSet):
+class IngredientVieWSet(ReferenceConditionalViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny, ]
@@ -31,19 +75,99 @@ class IngredientVieWSet(ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend, )
     filter_class = IngrigientFilter
 
+    def list(self, request, *args, **kwargs):
+        if 'name' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        return conditional_response(
+            self.search, request, etag=self._get_etag(request)
+        )
+
+    def search(self, request):
+        ''' autocomplete answered by the in-memory prefix index '''
+        try:
+            limit = int(request.query_params.get('limit'))
+        except (ValueError, TypeError):
+            limit = None
+        if limit is not None and limit < 1:
+            limit = None
+        return Response(
+            ingredient_index.search(request.query_params['name'], limit)
+        )
+
 
 class RecipeViewSet(ModelViewSet):
-    queryset = Recipe.objects.select_related('author').all().order_by('-id')
+    queryset = Recipe.objects.with_related().order_by('-id')
     serializer_class = RecipeSerializer
     permission_classes = [AllowAny, ]
-    filter_backends = (DjangoFilterBackend, )
+    filter_backends = (RecipeFilterBackend, )
     filterset_class = RecipeFilter
+    parser_classes = [JSONParser, MultiPartJSONParser, ]
+    multipart_json_fields = ('tags', 'ingredients', )
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update', ]:
             return RecipeWriteSerializer
         return RecipeSerializer
 
+    def get_queryset(self):
+        return super().get_queryset().with_user_flags(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        return cached_anonymous_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def _get_recipe_etag(self, request, recipe):
+        ''' recipe version + embedded data + per user flags '''
+        user = request.user
+        author = recipe.author
+        is_subscribed = (
+            user.is_authenticated
+            and user != author
+            and author.id in get_subscription_ids(request)
+        )
+        return make_etag(
+            recipe.pk,
+            recipe.updated.timestamp(),
+            get_reference_version(),
+            author.username,
+            author.first_name,
+            author.last_name,
+            author.email,
+            user.pk,
+            recipe.is_favorited,
+            recipe.is_in_shopping_cart,
+            is_subscribed,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        recipe = get_object_or_404(
+            Recipe.objects.select_related('author').with_user_flags(
+                request.user
+            ),
+            pk=kwargs['pk']
+        )
+        last_modified = None
+        if request.user.is_anonymous:
+            last_modified = recipe.updated
+        return conditional_response(
+            partial(cached_anonymous_response, super().retrieve),
+            request,
+            *args,
+            etag=self._get_recipe_etag(request, recipe),
+            last_modified=last_modified,
+            **kwargs
+        )
+
+    @action(
+        detail=False,
+        methods=['GET', ],
+        url_path='cache_stats',
+        permission_classes=[IsAdminUser, ]
+    )
+    def cache_stats(self, request):
+        return Response(get_cache_stats())
+
     def get_permissions(self):
         if self.action == 'create':
             self.permission_classes = [IsAuthenticated, ]
@@ -51,51 +175,93 @@ class RecipeViewSet(ModelViewSet):
             self.permission_classes = [IsAuthor, ]
         return super().get_permissions()
 
-    def _extra_action_methods_universal(self, name, request, pk=None):
-        instance = Recipe.objects.get(id=pk)
-        available_actions = {
-            'favorite': {
-                'related_model': instance.favorite_recipe,
-                'model': Favorite,
-                'serialiser_class': FavoriteSerializer,
-            },
-            'shopping_cart': {
-                'related_model': instance.shoppingcarts_recipe,
-                'model': ShoppingCart,
-                'serialiser_class': RecipeShoppingcartSerializer,
-            }
+    available_actions = {
+        'favorite': {
+            'model': Favorite,
+            'serialiser_class': FavoriteSerializer,
+        },
+        'shopping_cart': {
+            'model': ShoppingCart,
+            'serialiser_class': RecipeShoppingcartSerializer,
         }
+    }
 
-        if name not in available_actions:
+    def _extra_action_methods_universal(self, name, request, pk=None):
+        '''
+        Insert is a get_or_create: a concurrent double click is caught
+        on the relation's own unique constraint only, other integrity
+        errors surface. Delete reports the number of deleted rows
+        '''
+        if name not in self.available_actions:
             return Response(
                 {'errors': 'Bad request'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        related_models = available_actions[name]['related_model']
-        serializer_class = available_actions[name]['serialiser_class']
-        model = available_actions[name]['model']
-
-        related_object = related_models.filter(user=request.user).first()
+        serializer_class = self.available_actions[name]['serialiser_class']
+        model = self.available_actions[name]['model']
 
         if request.method == 'POST':
-            if related_object:
+            instance = get_object_or_404(Recipe, pk=pk)
+            _, created = model.objects.get_or_create(
+                user=request.user, recipe=instance
+            )
+            if not created:
                 return Response(
                     {'errors': f'Recipes is already in {name}'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             serializer = serializer_class(instance=instance)
-            model.objects.create(
-                user=request.user,
-                recipe=instance
-            )
             return Response(serializer.data)
 
-        if not related_object:
+        with transaction.atomic():
+            deleted, _ = model.objects.filter(
+                user=request.user,
+                recipe_id=pk
+            ).delete()
+            if deleted and model is ShoppingCart:
+                remove_recipe_from_totals(request.user.id, pk)
+        if not deleted:
             return Response(
                 {'errors': f'Recipes in {name} does not exist'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        related_object.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def _batch_action_methods_universal(self, name, request):
+        ''' add / remove many recipes with one bulk statement '''
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = set(serializer.validated_data['recipes'])
+        serializer_class = self.available_actions[name]['serialiser_class']
+        model = self.available_actions[name]['model']
+
+        if request.method == 'POST':
+            recipes = list(Recipe.objects.filter(id__in=recipe_ids))
+            missing = recipe_ids - {recipe.id for recipe in recipes}
+            if missing:
+                return Response(
+                    {'errors': f'Recipes do not exist: {sorted(missing)}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        with transaction.atomic():
+            if request.method == 'POST':
+                model.objects.bulk_create(
+                    [
+                        model(user=request.user, recipe=recipe)
+                        for recipe in recipes
+                    ],
+                    ignore_conflicts=True
+                )
+            else:
+                model.objects.filter(
+                    user=request.user,
+                    recipe_id__in=recipe_ids
+                ).delete()
+            if model is ShoppingCart:
+                rebuild_cart_totals([request.user.id])
+        if request.method == 'POST':
+            serializer = serializer_class(instance=recipes, many=True)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -120,11 +286,85 @@ class RecipeViewSet(ModelViewSet):
             pk
         )
 
+    @action(
+        detail=False,
+        methods=['GET', ],
+        url_path='shopping_cart_totals',
+        permission_classes=[IsAuthenticated, ]
+    )
+    def shopping_cart_totals(self, request):
+        return Response([
+            dict(zip(SHOPPING_LIST_FIELDS, row))
+            for row in get_shopping_list(request.user)
+        ])
+
+    @action(
+        detail=False,
+        methods=['GET', ],
+        url_path='feed',
+        permission_classes=[IsAuthenticated, ]
+    )
+    def feed(self, request):
+        ''' recipes of followed authors from the user's timeline '''
+        recipes = self.get_queryset().filter(feed_entries__user=request.user)
+        paginator = CustomCursorPaginator()
+        page = paginator.paginate_queryset(recipes, request, view=self)
+        serializer = RecipeSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['GET', ],
+        url_path='cook',
+        permission_classes=[AllowAny, ]
+    )
+    def cook(self, request):
+        '''
+        What can I cook: ?ingredients=<id>&ingredients=<id>[&max_missing=]
+        recipes using the given ingredients, fewest missing ones first
+        '''
+        serializer = PantrySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        ids = pantry_index.rank(
+            serializer.validated_data['ingredients'],
+            serializer.validated_data.get('max_missing')
+        )
+        page = self.paginate_queryset(RecipeIdList(ids, self.get_queryset()))
+        serializer = RecipeSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE', ],
+        url_path='favorite',
+        permission_classes=[IsAuthenticated, ]
+    )
+    def favorite_batch(self, request):
+        return self._batch_action_methods_universal('favorite', request)
+
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE', ],
+        url_path='shopping_cart',
+        permission_classes=[IsAuthenticated, ]
+    )
+    def shopping_cart_batch(self, request):
+        return self._batch_action_methods_universal('shopping_cart', request)
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
 
 @api_view(['GET', ])
 @permission_classes([IsAuthenticated, ])
+@renderer_classes([PDFRenderer, PlainTextRenderer, CSVRenderer, JSONRenderer])
 def generate_pdf_api(request):
-    return generate_pdf(request)
+    ''' format is negotiated by ?format=pdf|txt|csv|json or Accept header '''
+    export_format = request.accepted_renderer.format
+    if export_format == 'pdf':
+        return generate_pdf(request)
+    return stream_shopping_list(request, export_format)
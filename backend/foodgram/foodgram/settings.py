@@ -137,12 +137,36 @@ DJOSER = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+RECIPES_CACHE_TIMEOUT = int(os.getenv('RECIPES_CACHE_TIMEOUT', 300))
+CATALOG_DB_CHECK_INTERVAL = int(os.getenv('CATALOG_DB_CHECK_INTERVAL', 60))
+FEED_BACKFILL_LIMIT = int(os.getenv('FEED_BACKFILL_LIMIT', 100))
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+IMAGE_UPLOAD_MAX_BYTES = int(os.getenv('IMAGE_UPLOAD_MAX_BYTES', 5 * 1024 * 1024))
+IMAGE_UPLOAD_MAX_PIXELS = int(os.getenv('IMAGE_UPLOAD_MAX_PIXELS', 25_000_000))
+IMAGE_VARIANT_WIDTHS = tuple(int(width) for width in os.getenv('IMAGE_VARIANT_WIDTHS', '320,640,1280').split(','))
+IMAGE_THUMBNAIL_WIDTH = int(os.getenv('IMAGE_THUMBNAIL_WIDTH', 320))
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', 1))
+
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 PDF_FONTS_FILE = os.getenv('PDF_FONTS_FILE', 'arial.ttf')
 PDF_FONTS_FONTSIZE = int(os.getenv('PDF_FONTS_FONTSIZE', 12))
 PDF_GENERATED_FILENAME = os.getenv('PDF_GENERATED_FILENAME', 'shopping_cart.pdf')
+PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', os.path.join(BASE_DIR, 'pdf_cache'))
+PDF_CACHE_MAX_AGE = int(os.getenv('PDF_CACHE_MAX_AGE', 24 * 60 * 60))
+PDF_RENDER_WORKERS = int(os.getenv('PDF_RENDER_WORKERS', 2))
+PDF_RENDER_TIMEOUT = float(os.getenv('PDF_RENDER_TIMEOUT', 1))
+PDF_ACCEL_REDIRECT_PREFIX = os.getenv('PDF_ACCEL_REDIRECT_PREFIX', '')
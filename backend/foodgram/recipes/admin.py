@@ -1,10 +1,12 @@
 from django.contrib import admin
 from django.forms.models import BaseInlineFormSet
 from django.core.exceptions import ValidationError
+from django.db import transaction
 
 from recipes.models import (
     Tag, Recipe, Ingredient, RecipeToIngredient, RecipeToTag, ShoppingCart
 )
+from recipes.services import rebuild_cart_totals
 
 
 class CheckRequiredFormSet(BaseInlineFormSet):
@@ -67,6 +69,14 @@ class ShoppingCartInline(admin.TabularInline):
     extra = 1
 
 
+def _cart_user_ids(recipe):
+    return set(
+        ShoppingCart.objects.filter(
+            recipe=recipe
+        ).values_list('user_id', flat=True)
+    )
+
+
 class RecipeAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'image', 'text', )
     inlines = [
@@ -76,9 +86,36 @@ class RecipeAdmin(admin.ModelAdmin):
     ]
     empty_value_display = '-пусто-'
 
+    def save_related(self, request, form, formsets, change):
+        ''' carts edited inline: rebuild totals of old and new owners '''
+        user_ids = _cart_user_ids(form.instance)
+        super().save_related(request, form, formsets, change)
+        rebuild_cart_totals(user_ids | _cart_user_ids(form.instance))
+
+
+class ShoppingCartAdmin(admin.ModelAdmin):
+    list_display = ('user', 'recipe')
+
+    def save_model(self, request, obj, form, change):
+        user_ids = {obj.user_id}
+        if change:
+            user_ids.add(ShoppingCart.objects.get(pk=obj.pk).user_id)
+        super().save_model(request, obj, form, change)
+        rebuild_cart_totals(user_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rebuild_cart_totals([obj.user_id])
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        rebuild_cart_totals(user_ids)
+
 
 admin.site.register(Recipe, RecipeAdmin)
-admin.site.register(ShoppingCart)
+admin.site.register(ShoppingCart, ShoppingCartAdmin)
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Ingredient, IngridientAdmin)
 admin.site.register(RecipeToIngredient, RecipeToIngredientAdmin)
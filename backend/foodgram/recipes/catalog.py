@@ -0,0 +1,97 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from recipes.models import Ingredient, Recipe, Tag
+
+CATALOG_VERSION_KEY = 'recipes_catalog_version'
+REFERENCE_VERSION_KEY = 'recipes_reference_version'
+CATALOG_DB_CHECK_INTERVAL = settings.CATALOG_DB_CHECK_INTERVAL
+
+_stamps = {}
+
+
+def _new_version():
+    '''
+    Versions start from the current time, so a version key evicted
+    from the cache never restarts from a value that was already used
+    '''
+    return int(time.time() * 1000)
+
+
+def get_cached_version(key):
+    version = cache.get(key)
+    if version is not None:
+        return version
+    cache.add(key, _new_version(), timeout=None)
+    return cache.get(key)
+
+
+def bump_catalog_version(key=CATALOG_VERSION_KEY):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _new_version(), timeout=None)
+        return cache.get(key)
+
+
+def get_table_stamp(name, compute):
+    '''
+    Aggregates of a table read from the database at most once per
+    CATALOG_DB_CHECK_INTERVAL seconds. Unlike the cached versions,
+    they see writes made by other processes (management commands,
+    other workers) when the cache is local to every process
+    '''
+    now = time.monotonic()
+    checked, stamp = _stamps.get(name, (None, None))
+    if checked is None or now - checked >= CATALOG_DB_CHECK_INTERVAL:
+        stamp = compute()
+        _stamps[name] = (now, stamp)
+    return stamp
+
+
+def _catalog_stamp():
+    # relation changes touch Recipe.updated as well
+    stats = Recipe.objects.aggregate(count=Count('id'), last=Max('updated'))
+    last = stats['last']
+    return '{}.{}'.format(
+        stats['count'], int(last.timestamp() * 1000000) if last else 0
+    )
+
+
+def get_catalog_version():
+    '''
+    version of the recipes catalog: the table stamp picks up recipes
+    written by other processes, e.g. by import_recipes
+    '''
+    return '{}:{}'.format(
+        get_cached_version(CATALOG_VERSION_KEY),
+        get_table_stamp('catalog', _catalog_stamp)
+    )
+
+
+def _reference_stamp():
+    return '.'.join(
+        '{count}.{last}'.format(**model.objects.aggregate(
+            count=Count('id'), last=Max('id')
+        ))
+        for model in (Tag, Ingredient)
+    )
+
+
+def get_reference_version():
+    '''
+    version of the tags and ingredients reference data: rows added or
+    deleted in another process are picked up by the table stamp,
+    edits made there need a shared cache (CACHE_BACKEND)
+    '''
+    return '{}:{}'.format(
+        get_cached_version(REFERENCE_VERSION_KEY),
+        get_table_stamp('reference', _reference_stamp)
+    )
+
+
+def bump_reference_version():
+    return bump_catalog_version(REFERENCE_VERSION_KEY)
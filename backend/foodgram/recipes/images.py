@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import PurePosixPath
+
+import django
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections
+from PIL import Image
+
+from recipes.catalog import bump_catalog_version
+
+# no models here: the module is imported by the render worker processes
+
+IMAGE_VARIANT_WIDTHS = settings.IMAGE_VARIANT_WIDTHS
+IMAGE_THUMBNAIL_WIDTH = settings.IMAGE_THUMBNAIL_WIDTH
+IMAGE_VARIANT_WORKERS = settings.IMAGE_VARIANT_WORKERS
+IMAGE_VARIANTS_DIR = 'variants'
+IMAGE_VARIANT_QUALITY = 80
+
+_pending_lock = threading.Lock()
+_pending_variants = set()
+
+
+def get_variant_names(name):
+    '''
+    Variant names are derived from the original name: webp for
+    every width of the srcset and a jpeg thumbnail
+    '''
+    path = PurePosixPath(name)
+    base = path.parent / IMAGE_VARIANTS_DIR / path.stem
+    return {
+        'srcset': [
+            (width, f'{base}_{width}.webp') for width in IMAGE_VARIANT_WIDTHS
+        ],
+        'thumbnail': f'{base}_{IMAGE_THUMBNAIL_WIDTH}.jpg',
+    }
+
+
+def get_image_variants(name):
+    '''
+    Variant names of a processed image or None while it is processing.
+    The thumbnail is written last, so it marks a complete set
+    '''
+    variants = get_variant_names(name)
+    if not default_storage.exists(variants['thumbnail']):
+        return None
+    return variants
+
+
+def _save_variant(image, path, width, format, **params):
+    variant = image.copy()
+    variant.thumbnail((width, max(1, width * image.height // image.width)))
+    tmp_path = f'{path}.tmp'
+    variant.save(tmp_path, format, quality=IMAGE_VARIANT_QUALITY, **params)
+    os.replace(tmp_path, path)
+
+
+def render_image_variants(source, srcset, thumbnail):
+    ''' runs in a worker process, paths are on the local filesystem '''
+    os.makedirs(os.path.dirname(thumbnail), exist_ok=True)
+    with Image.open(source) as image:
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        for width, path in srcset:
+            _save_variant(image, path, width, 'WEBP', method=4)
+        _save_variant(
+            image.convert('RGB'), thumbnail, IMAGE_THUMBNAIL_WIDTH, 'JPEG',
+            optimize=True, progressive=True
+        )
+
+
+@lru_cache(maxsize=None)
+def _get_executor():
+    '''
+    bounded pool, created lazily in each web worker process.
+    Workers start from a fork server: the done callbacks use the
+    database in the pool thread, and a fork of this process would
+    inherit (and close) that thread's connection
+    '''
+    return ProcessPoolExecutor(
+        max_workers=IMAGE_VARIANT_WORKERS,
+        mp_context=multiprocessing.get_context('forkserver'),
+        initializer=django.setup,
+    )
+
+
+def _variants_done(name, future, on_ready):
+    with _pending_lock:
+        _pending_variants.discard(name)
+    if future.exception() is None:
+        if on_ready is not None:
+            on_ready(name)
+            # the callback thread outlives requests, do not keep
+            # its connection open
+            connections.close_all()
+        # cached responses still point at the original image
+        bump_catalog_version()
+
+
+def schedule_image_variants(name, on_ready=None):
+    '''
+    Render the variants of an uploaded image in the process pool,
+    off the request path. on_ready(name) is called once the variants
+    exist, right away for an already rendered image. Pending images
+    are skipped
+    '''
+    if not name:
+        return None
+    if get_image_variants(name) is not None:
+        if on_ready is not None:
+            on_ready(name)
+        return None
+    with _pending_lock:
+        if name in _pending_variants:
+            return None
+        _pending_variants.add(name)
+    variants = get_variant_names(name)
+    args = (
+        default_storage.path(name),
+        [
+            (width, default_storage.path(path))
+            for width, path in variants['srcset']
+        ],
+        default_storage.path(variants['thumbnail']),
+    )
+    try:
+        future = _get_executor().submit(render_image_variants, *args)
+    except RuntimeError:
+        # broken pool (a worker died), start a new one
+        _get_executor.cache_clear()
+        future = _get_executor().submit(render_image_variants, *args)
+    future.add_done_callback(
+        lambda done: _variants_done(name, done, on_ready)
+    )
+    return future
@@ -0,0 +1,480 @@
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+
+import numpy as np
+
+from recipes.catalog import get_catalog_version
+from recipes.models import Recipe, RecipeToIngredient, RecipeToTag
+from recipes.registry import reference_registry
+
+PREFIX_UPPER_BOUND = '\U0010ffff'
+# transactions commit after Recipe.updated is set, recently updated
+# recipes are read again on every refresh
+RECIPE_INDEX_OVERLAP = timedelta(seconds=60)
+RECIPE_INDEX_BATCH_SIZE = 500
+
+
+class IngredientPrefixIndex:
+    '''
+    Per-process prefix index over case-folded ingredient names.
+    Rows are kept in a sorted array, a prefix is answered with two
+    binary searches. The index is rebuilt whenever the reference
+    registry reloads its data
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None
+        self._index = ([], [])
+
+    def _build(self, source):
+        rows = sorted(
+            (ingredient['name'].casefold(), ingredient['id'], ingredient)
+            for ingredient in source.ingredients.values()
+        )
+        keys = [key for key, _, _ in rows]
+        items = [ingredient for _, _, ingredient in rows]
+        return keys, items
+
+    def _get_index(self):
+        source = reference_registry.data
+        if source is not self._source:
+            with self._lock:
+                if source is not self._source:
+                    self._index = self._build(source)
+                    self._source = source
+        return self._index
+
+    def search(self, prefix, limit=None):
+        '''
+        Ingredients starting with prefix: exact match first,
+        then shorter names, then alphabetically
+        '''
+        keys, items = self._get_index()
+        prefix = prefix.casefold()
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + PREFIX_UPPER_BOUND, lo=start)
+        positions = sorted(
+            range(start, end),
+            key=lambda position: (
+                keys[position] != prefix, len(keys[position])
+            )
+        )
+        return [dict(items[position]) for position in positions[:limit]]
+
+
+ingredient_index = IngredientPrefixIndex()
+
+
+def _bits_from_ids(ids):
+    ''' int bitset from recipe ids, built in one pass over a bytearray '''
+    if not len(ids):
+        return 0
+    data = bytearray(max(ids) // 8 + 1)
+    for recipe_id in ids:
+        data[recipe_id >> 3] |= 1 << (recipe_id & 7)
+    return int.from_bytes(data, 'little')
+
+
+def iter_ids_desc(bits):
+    ''' recipe ids of a bitset, newest (highest id) first '''
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for position in range(len(data) - 1, -1, -1):
+        byte = data[position]
+        if not byte:
+            continue
+        for bit in range(7, -1, -1):
+            if byte >> bit & 1:
+                yield position * 8 + bit
+
+
+class BitsetIds:
+    ''' ids of a bitset as a sequence: len() and slices '''
+
+    def __init__(self, bits):
+        self.bits = bits
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __getitem__(self, key):
+        return list(islice(iter_ids_desc(self.bits), key.start, key.stop))
+
+
+class RecipeIdList:
+    '''
+    Lazy list of recipes selected by an index, in the order of ids.
+    Paginator takes len() and a slice: only the recipes of the page
+    are loaded from the queryset
+    '''
+
+    def __init__(self, ids, queryset):
+        self.ids = ids
+        self.queryset = queryset
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        ids = [int(pk) for pk in self.ids[key.start:key.stop]]
+        recipes = self.queryset.filter(id__in=ids).in_bulk()
+        return [recipes[pk] for pk in ids if pk in recipes]
+
+    def __iter__(self):
+        return iter(self[:])
+
+
+class RecipeIndex:
+    '''
+    Base of the per-process recipe indexes over a recipe relation.
+    Loaded on first use. When the catalog version changes, recipes
+    updated since the last refresh are re-indexed (Recipe.updated is
+    touched by relation changes as well), deleted and missed recipes
+    are found by comparing the recipe count
+    '''
+    relation_model = None
+    relation_field = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built = False
+        self._watermark = None
+        self._count = 0
+        self._reset()
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def _load(self, recipes, related):
+        ''' full build from (id, author_id) rows and {id: [related ids]} '''
+        raise NotImplementedError
+
+    def _discard(self, recipe_id):
+        ''' returns True when the recipe was indexed '''
+        raise NotImplementedError
+
+    def _add(self, recipe_id, author_id, related_ids):
+        raise NotImplementedError
+
+    def _indexed_ids(self):
+        raise NotImplementedError
+
+    def _flush(self):
+        ''' called after every _index batch, for buffered adds '''
+
+    def _get_related(self, recipe_ids=None):
+        related = defaultdict(list)
+        rows = self.relation_model.objects.values_list(
+            'recipe_id', self.relation_field
+        )
+        if recipe_ids is not None:
+            rows = rows.filter(recipe_id__in=recipe_ids)
+        for recipe_id, related_id in rows:
+            related[recipe_id].append(related_id)
+        return related
+
+    def _index(self, recipes):
+        ''' (re)index rows of (id, author_id, updated) '''
+        related = defaultdict(list)
+        for start in range(0, len(recipes), RECIPE_INDEX_BATCH_SIZE):
+            batch = recipes[start:start + RECIPE_INDEX_BATCH_SIZE]
+            related.update(self._get_related(
+                [recipe_id for recipe_id, _, _ in batch]
+            ))
+        for recipe_id, author_id, updated in recipes:
+            if self._discard(recipe_id):
+                self._count -= 1
+            self._add(recipe_id, author_id, related[recipe_id])
+            self._count += 1
+            if self._watermark is None or updated > self._watermark:
+                self._watermark = updated
+        self._flush()
+
+    def _build(self):
+        recipes = list(Recipe.objects.values_list(
+            'id', 'author_id', 'updated'
+        ).order_by('id'))
+        self._reset()
+        self._load(
+            [(recipe_id, author_id) for recipe_id, author_id, _ in recipes],
+            self._get_related()
+        )
+        self._count = len(recipes)
+        self._watermark = max(
+            (updated for _, _, updated in recipes), default=None
+        )
+        self._built = True
+
+    def _refresh(self):
+        if not self._built:
+            self._build()
+            return
+        recipes = Recipe.objects.values_list('id', 'author_id', 'updated')
+        if self._watermark is not None:
+            self._index(list(recipes.filter(
+                updated__gte=self._watermark - RECIPE_INDEX_OVERLAP
+            )))
+        if Recipe.objects.count() == self._count:
+            return
+        existing = set(Recipe.objects.values_list('id', flat=True))
+        indexed = self._indexed_ids()
+        missing = list(existing - indexed)
+        if len(missing) > len(indexed):
+            # e.g. after a bulk import: a full build is cheaper
+            self._build()
+            return
+        for recipe_id in indexed - existing:
+            if self._discard(recipe_id):
+                self._count -= 1
+        for start in range(0, len(missing), RECIPE_INDEX_BATCH_SIZE):
+            self._index(list(recipes.filter(
+                id__in=missing[start:start + RECIPE_INDEX_BATCH_SIZE]
+            )))
+
+    def _ensure_current(self):
+        version = get_catalog_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._refresh()
+                    self._version = version
+
+
+class RecipeBitmapIndex(RecipeIndex):
+    '''
+    Tag id -> int bitset of recipe ids, author id -> sorted array of
+    recipe ids. Filters are answered with bitset unions / intersections
+    '''
+    relation_model = RecipeToTag
+    relation_field = 'tag_id'
+
+    def _reset(self):
+        self._tag_bits = {}
+        self._author_ids = {}
+        self._author_by_recipe = array('q')
+
+    def _load(self, recipes, related):
+        recipe_ids_by_tag = defaultdict(list)
+        for recipe_id, tag_ids in related.items():
+            for tag_id in tag_ids:
+                recipe_ids_by_tag[tag_id].append(recipe_id)
+        author_ids = defaultdict(lambda: array('q'))
+        self._author_by_recipe = array('q', [0]) * (
+            recipes[-1][0] + 1 if recipes else 0
+        )
+        for recipe_id, author_id in recipes:
+            author_ids[author_id].append(recipe_id)
+            self._author_by_recipe[recipe_id] = author_id
+        self._tag_bits = {
+            tag_id: _bits_from_ids(ids)
+            for tag_id, ids in recipe_ids_by_tag.items()
+        }
+        self._author_ids = dict(author_ids)
+
+    def _discard(self, recipe_id):
+        if recipe_id >= len(self._author_by_recipe):
+            return False
+        author_id = self._author_by_recipe[recipe_id]
+        if not author_id:
+            return False
+        mask = 1 << recipe_id
+        for tag_id, bits in self._tag_bits.items():
+            if bits & mask:
+                self._tag_bits[tag_id] = bits ^ mask
+        ids = self._author_ids[author_id]
+        del ids[bisect_left(ids, recipe_id)]
+        self._author_by_recipe[recipe_id] = 0
+        return True
+
+    def _add(self, recipe_id, author_id, tag_ids):
+        authors = self._author_by_recipe
+        if recipe_id >= len(authors):
+            authors.extend([0] * (recipe_id + 1 - len(authors)))
+        authors[recipe_id] = author_id
+        mask = 1 << recipe_id
+        for tag_id in tag_ids:
+            self._tag_bits[tag_id] = self._tag_bits.get(tag_id, 0) | mask
+        insort(self._author_ids.setdefault(author_id, array('q')), recipe_id)
+
+    def _indexed_ids(self):
+        return {
+            recipe_id
+            for recipe_id, author_id in enumerate(self._author_by_recipe)
+            if author_id
+        }
+
+    def select(self, tag_ids=None, author_id=None):
+        '''
+        Ids (newest first) of recipes having any of tag_ids
+        and written by author_id
+        '''
+        self._ensure_current()
+        with self._lock:
+            bits = None
+            if tag_ids:
+                bits = 0
+                for tag_id in tag_ids:
+                    bits |= self._tag_bits.get(tag_id, 0)
+            if author_id is not None:
+                author_bits = _bits_from_ids(
+                    self._author_ids.get(author_id, ())
+                )
+                bits = author_bits if bits is None else bits & author_bits
+        return BitsetIds(bits or 0)
+
+
+class PantryIndex(RecipeIndex):
+    '''
+    Inverted index ingredient id -> postings (numpy arrays of recipe
+    positions) for "what can I cook". Recipes are scored by counting
+    the postings of the available ingredients with np.bincount.
+    A changed recipe gets a new position, the old one is left dead in
+    the postings and skipped by its zero size; the index is rebuilt
+    once dead positions make up half of it. Added recipes are buffered
+    and appended to the arrays once per batch
+    '''
+    relation_model = RecipeToIngredient
+    relation_field = 'ingredient_id'
+
+    def _reset(self):
+        self._positions = {}
+        self._recipe_ids = np.zeros(0, dtype=np.int64)
+        self._sizes = np.zeros(0, dtype=np.int32)
+        self._postings = {}
+        self._dead = 0
+        self._pending = []
+
+    def _load(self, recipes, related):
+        recipe_ids = np.fromiter(
+            (recipe_id for recipe_id, _ in recipes),
+            dtype=np.int64, count=len(recipes)
+        )
+        rows = [
+            (recipe_id, ingredient_id)
+            for recipe_id, ingredient_ids in related.items()
+            for ingredient_id in ingredient_ids
+        ]
+        row_recipes = np.fromiter(
+            (recipe_id for recipe_id, _ in rows),
+            dtype=np.int64, count=len(rows)
+        )
+        row_ingredients = np.fromiter(
+            (ingredient_id for _, ingredient_id in rows),
+            dtype=np.int64, count=len(rows)
+        )
+        known = np.isin(row_recipes, recipe_ids)
+        positions = np.searchsorted(recipe_ids, row_recipes[known])
+        row_ingredients = row_ingredients[known]
+        order = np.argsort(row_ingredients, kind='stable')
+        ingredients, starts = np.unique(
+            row_ingredients[order], return_index=True
+        )
+        self._postings = dict(zip(
+            ingredients.tolist(),
+            np.split(positions[order].astype(np.int32), starts[1:])
+        ))
+        self._recipe_ids = recipe_ids
+        self._sizes = np.bincount(
+            positions, minlength=len(recipe_ids)
+        ).astype(np.int32)
+        self._positions = dict(zip(
+            recipe_ids.tolist(), range(len(recipe_ids))
+        ))
+
+    def _discard(self, recipe_id):
+        position = self._positions.pop(recipe_id, None)
+        if position is None:
+            return False
+        self._sizes[position] = 0
+        self._dead += 1
+        if self._dead * 2 > len(self._sizes):
+            self._built = False
+        return True
+
+    def _add(self, recipe_id, author_id, ingredient_ids):
+        position = len(self._recipe_ids) + len(self._pending)
+        self._positions[recipe_id] = position
+        self._pending.append((recipe_id, ingredient_ids))
+
+    def _flush(self):
+        ''' one concatenate per array instead of np.append per recipe '''
+        if not self._pending:
+            return
+        start = len(self._recipe_ids)
+        count = len(self._pending)
+        self._recipe_ids = np.concatenate((
+            self._recipe_ids,
+            np.fromiter(
+                (recipe_id for recipe_id, _ in self._pending),
+                dtype=np.int64, count=count
+            )
+        ))
+        self._sizes = np.concatenate((
+            self._sizes,
+            np.fromiter(
+                (len(ingredient_ids) for _, ingredient_ids in self._pending),
+                dtype=np.int32, count=count
+            )
+        ))
+        added = defaultdict(list)
+        for offset, (_, ingredient_ids) in enumerate(self._pending):
+            for ingredient_id in ingredient_ids:
+                added[ingredient_id].append(start + offset)
+        for ingredient_id, positions in added.items():
+            self._postings[ingredient_id] = np.concatenate((
+                self._postings.get(
+                    ingredient_id, np.zeros(0, dtype=np.int32)
+                ),
+                np.array(positions, dtype=np.int32)
+            ))
+        self._pending = []
+
+    def _indexed_ids(self):
+        return set(self._positions)
+
+    def _refresh(self):
+        super()._refresh()
+        if not self._built:
+            self._build()
+
+    def rank(self, ingredient_ids, max_missing=None):
+        '''
+        Ids of recipes using any of ingredient_ids: fewest missing
+        ingredients first, then most matched, then newest
+        '''
+        self._ensure_current()
+        with self._lock:
+            postings = [
+                self._postings[ingredient_id]
+                for ingredient_id in set(ingredient_ids)
+                if ingredient_id in self._postings
+            ]
+            if not postings:
+                return np.zeros(0, dtype=np.int64)
+            matched = np.bincount(
+                np.concatenate(postings), minlength=len(self._sizes)
+            )
+            sizes = self._sizes
+            recipe_ids = self._recipe_ids
+        missing = sizes - matched
+        candidates = (matched > 0) & (sizes > 0)
+        if max_missing is not None:
+            candidates &= missing <= max_missing
+        candidates = np.flatnonzero(candidates)
+        order = np.lexsort((
+            -recipe_ids[candidates],
+            -matched[candidates],
+            missing[candidates],
+        ))
+        return recipe_ids[candidates[order]]
+
+
+recipe_index = RecipeBitmapIndex()
+pantry_index = PantryIndex()
@@ -0,0 +1,35 @@
+from concurrent.futures import wait
+
+from django.core.management.base import BaseCommand
+
+from recipes.images import schedule_image_variants
+from recipes.models import Recipe
+from recipes.services import mark_image_variants
+
+
+class Command(BaseCommand):
+    '''
+    Render missing thumbnail / webp variants of recipe images,
+    e.g. for recipes loaded with import_recipes or uploaded before
+    using:
+    python manage.py generate_image_variants
+    '''
+    help = 'Generate missing recipe image variants'
+
+    def handle(self, *args, **options):
+        futures = {}
+        names = Recipe.objects.values_list('image', flat=True).distinct()
+        for name in names.iterator():
+            future = schedule_image_variants(name, mark_image_variants)
+            if future is not None:
+                futures[future] = name
+        wait(futures)
+        failed = [
+            name for future, name in futures.items() if future.exception()
+        ]
+        for name in failed:
+            self.stderr.write(f"Failed to render {name}")
+        self.stdout.write(
+            f"Rendered {len(futures) - len(failed)} images, "
+            f"failed {len(failed)}"
+        )
@@ -1,32 +1,45 @@
-import csv
 import os
+import time
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
+from recipes.catalog import bump_reference_version
+from recipes.management.readers import iter_chunks, iter_csv, iter_json_array
 from recipes.models import Ingredient
 
 ALLOWED_MODELS = {
     'Ingredient': Ingredient,
 }
+UNIQUE_FIELDS = {
+    'Ingredient': ('name', 'measurement_unit'),
+}
+ALLOWED_FORMATS = ('.csv', '.json')
 
 
 class Command(BaseCommand):
     '''
-    Custom management command for load data into the Models from CSV file
+    Custom management command for load data into the Models from CSV
+    or JSON file. Rows are read and written in chunks, rows that already
+    exist are skipped, so the command can be run again on the same file
     using:
     python manage.py import_csv --model <model_name> --path <path_to_the_file>
+        [--chunk-size 1000] [--dry-run]
     '''
-    help = 'Load a csv file into the database'
+    help = 'Load a csv or json file into the database'
 
-    def _checker(self, model, path):
+    def _checker(self, model, path, chunk_size):
         if model not in ALLOWED_MODELS:
             self.stderr.write(f"Model {model} is not in Allowed list")
             return False
         if not os.path.exists(path):
             self.stderr.write(f"File {path} doesn't exist")
             return False
-        if not path.endswith('.csv'):
-            self.stderr.write(f"File {path} doesn't csv format")
+        if not path.endswith(ALLOWED_FORMATS):
+            self.stderr.write(f"File {path} doesn't csv or json format")
+            return False
+        if chunk_size < 1:
+            self.stderr.write("Chunk size must be positive")
             return False
         return True
 
@@ -35,20 +48,66 @@ class Command(BaseCommand):
             '--model', type=str, required=True, help="Name of ORM Model"
         )
         parser.add_argument(
-            '--path', type=str, required=True, help="Path to the csv file"
+            '--path', type=str, required=True, help="Path to the file"
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help="Rows per database round trip"
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Count new rows without writing them"
+        )
+
+    def _read(self, file, path, fields):
+        if path.endswith('.json'):
+            rows = iter_json_array(file)
+        else:
+            rows = iter_csv(file, fields)
+        for row in rows:
+            values = tuple(
+                str(row.get(field) or '').strip() for field in fields
+            )
+            if all(values):
+                yield values
+
+    def _new_rows(self, model, fields, chunk):
+        ''' drop rows repeated in the chunk or existing in the database '''
+        chunk = list(dict.fromkeys(chunk))
+        existing = set(model.objects.filter(
+            **{f'{fields[0]}__in': {values[0] for values in chunk}}
+        ).values_list(*fields))
+        return [values for values in chunk if values not in existing]
 
     def handle(self, *args, **options):
-        model = options['model']
+        model_name = options['model']
         path = options['path']
-        if self._checker(model, path):
-            model = ALLOWED_MODELS[model]
-            with open(path, 'r') as f:
-                reader = csv.reader(f, dialect='excel')
-                for name, measure in reader:
-                    if name and measure:
-                        model.objects.get_or_create(
-                            name=name,
-                            measurement_unit=measure,
-                        )
-            self.stdout.write("Loaded")
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+        if not self._checker(model_name, path, chunk_size):
+            return
+        model = ALLOWED_MODELS[model_name]
+        fields = UNIQUE_FIELDS[model_name]
+        read = created = 0
+        started = time.monotonic()
+        with open(path, 'r', encoding='utf-8') as f:
+            for chunk in iter_chunks(self._read(f, path, fields), chunk_size):
+                read += len(chunk)
+                rows = self._new_rows(model, fields, chunk)
+                created += len(rows)
+                if rows and not dry_run:
+                    model.objects.bulk_create(
+                        [model(**dict(zip(fields, row))) for row in rows],
+                        ignore_conflicts=True,
+                    )
+        if created and not dry_run:
+            transaction.on_commit(bump_reference_version)
+        elapsed = time.monotonic() - started
+        rate = read / max(elapsed, 1e-9)
+        self.stdout.write(
+            f"{'Would load' if dry_run else 'Loaded'} {created} of {read} "
+            f"rows in {elapsed:.1f}s ({rate:.0f} rows/sec)"
+        )
@@ -0,0 +1,265 @@
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+from recipes.catalog import bump_catalog_version
+from recipes.services import fan_out_recipes
+from recipes.management.readers import iter_json_array, iter_ndjson
+from recipes.models import (
+    Ingredient, Recipe, RecipeToIngredient, RecipeToTag, Tag
+)
+
+User = get_user_model()
+
+
+def iter_json_records(file):
+    return enumerate(iter_json_array(file), 1)
+
+
+# reader yielding (position, record) and the name of the position
+READERS = {
+    '.ndjson': (iter_ndjson, 'Line'),
+    '.jsonl': (iter_ndjson, 'Line'),
+    '.json': (iter_json_records, 'Record'),
+}
+RECIPE_STRING_FIELDS = ('name', 'text', 'image')
+
+
+def is_text(value):
+    return isinstance(value, str) and bool(value.strip())
+
+
+def to_positive_int(value, field):
+    ''' 5 or "5", bool and float values are not counts '''
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+        raise ValueError(f'{field} must be a positive integer')
+    return value
+
+
+def validate_ingredient(position, item):
+    if not isinstance(item, dict):
+        raise ValueError(f'ingredient {position} must be an object')
+    if not is_text(item.get('name')):
+        raise ValueError(
+            f'ingredient {position}: name must be a non-empty string'
+        )
+    unit = item.get('measurement_unit')
+    if unit is not None and not is_text(unit):
+        raise ValueError(
+            f'ingredient {position}: measurement_unit must be '
+            'a non-empty string'
+        )
+
+
+class Command(BaseCommand):
+    '''
+    Bulk import of recipes from NDJSON / JSON files
+    using:
+    python manage.py import_recipes --path <file> [--chunk-size 1000]
+        [--author <email>]
+    record: {"name", "text", "cooking_time", "image" (path in MEDIA_ROOT),
+             "author" (email, username or id), "tags": [slug, ...],
+             "ingredients": [{"name", "measurement_unit", "amount"}]}
+    '''
+    help = 'Load recipes from a NDJSON or JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', type=str, required=True, help="Path to the file"
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help="Recipes per transaction"
+        )
+        parser.add_argument(
+            '--author',
+            type=str,
+            help="Default author (email, username or id)"
+        )
+
+    def _load_maps(self):
+        ''' reference data resolved in memory, one query per model '''
+        self.tags = dict(Tag.objects.values_list('slug', 'id'))
+        self.ingredients = {}
+        self.ingredients_by_name = {}
+        for pk, name, unit in Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit'
+        ):
+            self.ingredients[(name.casefold(), unit.casefold())] = pk
+            self.ingredients_by_name.setdefault(name.casefold(), []).append(pk)
+        self.authors = {}
+        for pk, email, username in User.objects.values_list(
+            'id', 'email', 'username'
+        ):
+            self.authors[str(pk)] = pk
+            self.authors[email] = pk
+            self.authors[username] = pk
+
+    def _validate(self, record):
+        '''
+        Shape of a record, checked before any lookup: every problem
+        is reported as a ValueError with a readable reason
+        '''
+        if not isinstance(record, dict):
+            raise ValueError('record must be an object')
+        for field in RECIPE_STRING_FIELDS:
+            if not is_text(record.get(field)):
+                raise ValueError(f'{field} must be a non-empty string')
+        author = record.get('author', self.default_author)
+        if author is None:
+            raise ValueError('author is missing and --author is not set')
+        if not isinstance(author, (str, int)) or isinstance(author, bool):
+            raise ValueError('author must be an email, username or id')
+        tags = record.get('tags', [])
+        if not isinstance(tags, list) or not all(map(is_text, tags)):
+            raise ValueError('tags must be a list of slugs')
+        ingredients = record.get('ingredients')
+        if not isinstance(ingredients, list) or not ingredients:
+            raise ValueError('ingredients must be a non-empty list')
+        for position, item in enumerate(ingredients, 1):
+            validate_ingredient(position, item)
+
+    def _resolve_ingredient(self, item):
+        name = item['name'].casefold()
+        unit = item.get('measurement_unit')
+        if unit is not None:
+            ingredient = self.ingredients.get((name, unit.casefold()))
+            if ingredient is None:
+                raise ValueError(
+                    f'unknown ingredient {item["name"]} ({unit})'
+                )
+            return ingredient
+        candidates = self.ingredients_by_name.get(name, [])
+        if not candidates:
+            raise ValueError(f'unknown ingredient {item["name"]}')
+        if len(candidates) != 1:
+            raise ValueError(
+                f'ingredient {item["name"]} has several units, '
+                'measurement_unit is required'
+            )
+        return candidates[0]
+
+    def _image_name(self, image):
+        if os.path.isabs(image):
+            return os.path.relpath(image, self.media_root)
+        return image
+
+    def _build(self, record):
+        ''' validate a record, returns the recipe and its relations '''
+        self._validate(record)
+        author = record.get('author', self.default_author)
+        if str(author) not in self.authors:
+            raise ValueError(f'unknown author {author}')
+        recipe = Recipe(
+            name=record['name'],
+            text=record['text'],
+            cooking_time=to_positive_int(
+                record.get('cooking_time'), 'cooking_time'
+            ),
+            image=self._image_name(record['image']),
+            author_id=self.authors[str(author)],
+        )
+        unknown_tags = set(record.get('tags', [])) - set(self.tags)
+        if unknown_tags:
+            raise ValueError(f'unknown tags {", ".join(sorted(unknown_tags))}')
+        tags = {self.tags[slug] for slug in record.get('tags', [])}
+        ingredients = {}
+        for position, item in enumerate(record['ingredients'], 1):
+            amount = to_positive_int(
+                item.get('amount'), f'ingredient {position}: amount'
+            )
+            ingredient = self._resolve_ingredient(item)
+            ingredients[ingredient] = ingredients.get(ingredient, 0) + amount
+        return recipe, tags, ingredients
+
+    def _next_ids(self, count):
+        '''
+        Backends that can not return ids from a bulk insert (SQLite)
+        get explicit ids, chunks run inside a write transaction
+        '''
+        last_id = Recipe.objects.aggregate(last_id=Max('id'))['last_id']
+        first_id = (last_id or 0) + 1
+        return range(first_id, first_id + count)
+
+    @transaction.atomic
+    def _write_chunk(self, chunk):
+        recipes = [recipe for recipe, _, _ in chunk]
+        if not connection.features.can_return_rows_from_bulk_insert:
+            for recipe, pk in zip(recipes, self._next_ids(len(recipes))):
+                recipe.id = pk
+        Recipe.objects.bulk_create(recipes)
+        RecipeToTag.objects.bulk_create([
+            RecipeToTag(recipe_id=recipe.id, tag_id=tag)
+            for recipe, tags, _ in chunk
+            for tag in tags
+        ])
+        RecipeToIngredient.objects.bulk_create([
+            RecipeToIngredient(
+                recipe_id=recipe.id,
+                ingredient_id=ingredient,
+                amount=amount
+            )
+            for recipe, _, ingredients in chunk
+            for ingredient, amount in ingredients.items()
+        ])
+        fan_out_recipes([(recipe.id, recipe.author_id) for recipe in recipes])
+        transaction.on_commit(bump_catalog_version)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        chunk_size = options['chunk_size']
+        extension = os.path.splitext(path)[1].lower()
+        if not os.path.exists(path):
+            raise CommandError(f"File {path} doesn't exist")
+        if extension not in READERS:
+            raise CommandError(f"File {path} isn't ndjson or json format")
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be positive")
+        self.default_author = options['author']
+        self.media_root = str(settings.MEDIA_ROOT)
+        self.verbosity = options['verbosity']
+        self._load_maps()
+
+        loaded = skipped = 0
+        started = time.monotonic()
+        chunk = []
+        reader, position = READERS[extension]
+        with open(path, 'r', encoding='utf-8') as file:
+            for number, record in reader(file):
+                try:
+                    chunk.append(self._build(record))
+                except ValueError as error:
+                    skipped += 1
+                    self.stderr.write(
+                        f"{position} {number} skipped: {error}"
+                    )
+                    continue
+                if len(chunk) >= chunk_size:
+                    loaded += self._flush(chunk, loaded, started)
+                    chunk = []
+        if chunk:
+            loaded += self._flush(chunk, loaded, started)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Loaded {loaded} recipes, skipped {skipped} "
+            f"in {elapsed:.1f}s ({loaded / max(elapsed, 1e-9):.0f} rows/sec)"
+        )
+
+    def _flush(self, chunk, loaded, started):
+        self._write_chunk(chunk)
+        loaded += len(chunk)
+        if self.verbosity > 1:
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"{loaded} recipes, {loaded / max(elapsed, 1e-9):.0f} rows/sec"
+            )
+        return len(chunk)
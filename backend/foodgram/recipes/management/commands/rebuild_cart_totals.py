@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from recipes.services import rebuild_cart_totals, verify_cart_totals
+
+
+class Command(BaseCommand):
+    '''
+    Rebuild or verify the materialized shopping cart totals
+    using:
+    python manage.py rebuild_cart_totals [--verify] [--user <id> ...]
+    '''
+    help = 'Rebuild or verify shopping cart totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help="Only report users with wrong totals"
+        )
+        parser.add_argument(
+            '--user', type=int, nargs='+', help="Limit to these user ids"
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['user']
+        mismatched = verify_cart_totals(user_ids)
+        if options['verify']:
+            if mismatched:
+                self.stderr.write(
+                    f"Wrong totals for users: {sorted(mismatched)}"
+                )
+            else:
+                self.stdout.write("Totals are consistent")
+            return
+        rows = rebuild_cart_totals(user_ids)
+        self.stdout.write(
+            f"Rebuilt {rows} rows, fixed {len(mismatched)} users"
+        )
@@ -0,0 +1,56 @@
+import csv
+import json
+from itertools import islice
+
+from django.core.management.base import CommandError
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def iter_ndjson(file):
+    ''' (line number, record) for every non blank line '''
+    for number, line in enumerate(file, 1):
+        line = line.strip()
+        if line:
+            yield number, json.loads(line)
+
+
+def iter_json_array(file):
+    '''
+    Yield items of a top level JSON array without loading the whole
+    file: items are decoded one by one from a sliding buffer
+    '''
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('JSON file must contain an array')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                raise CommandError('Unexpected end of JSON file')
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def iter_csv(file, fieldnames):
+    ''' rows of a headerless CSV file as dicts '''
+    for row in csv.reader(file, dialect='excel'):
+        if row:
+            yield dict(zip(fieldnames, row))
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
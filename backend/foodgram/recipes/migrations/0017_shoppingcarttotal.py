@@ -0,0 +1,56 @@
+# Generated by Django 3.2 on 2026-10-18 10:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def build_cart_totals(apps, schema_editor):
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    ShoppingCartTotal = apps.get_model('recipes', 'ShoppingCartTotal')
+    rows = ShoppingCart.objects.filter(
+        recipe__recipe_ingridients__isnull=False
+    ).values(
+        'user_id', 'recipe__recipe_ingridients__ingredient_id'
+    ).annotate(total=Sum('recipe__recipe_ingridients__amount'))
+    ShoppingCartTotal.objects.bulk_create(
+        [
+            ShoppingCartTotal(
+                user_id=row['user_id'],
+                ingredient_id=row['recipe__recipe_ingridients__ingredient_id'],
+                amount=row['total'],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0016_recipe_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipes.ingredient', verbose_name='Ингридиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shoppingcart_totals', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Итог корзины покупок',
+                'verbose_name_plural': 'Итоги корзин покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcarttotal',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_user_ingredient_total'),
+        ),
+        migrations.RunPython(build_cart_totals, migrations.RunPython.noop),
+    ]
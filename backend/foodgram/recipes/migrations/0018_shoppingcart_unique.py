@@ -0,0 +1,53 @@
+# Generated by Django 3.2 on 2026-10-18 10:17
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def remove_duplicate_carts(apps, schema_editor):
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    ShoppingCartTotal = apps.get_model('recipes', 'ShoppingCartTotal')
+    duplicates = ShoppingCart.objects.values(
+        'user_id', 'recipe_id'
+    ).annotate(first_id=Min('id'), rows=Count('id')).filter(rows__gt=1)
+    user_ids = set()
+    for row in duplicates:
+        ShoppingCart.objects.filter(
+            user_id=row['user_id'], recipe_id=row['recipe_id']
+        ).exclude(id=row['first_id']).delete()
+        user_ids.add(row['user_id'])
+    if not user_ids:
+        return
+    ShoppingCartTotal.objects.filter(user_id__in=user_ids).delete()
+    rows = ShoppingCart.objects.filter(
+        user_id__in=user_ids,
+        recipe__recipe_ingridients__isnull=False
+    ).values(
+        'user_id', 'recipe__recipe_ingridients__ingredient_id'
+    ).annotate(total=Sum('recipe__recipe_ingridients__amount'))
+    ShoppingCartTotal.objects.bulk_create(
+        [
+            ShoppingCartTotal(
+                user_id=row['user_id'],
+                ingredient_id=row['recipe__recipe_ingridients__ingredient_id'],
+                amount=row['total'],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_shoppingcarttotal'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_user_recipe_cart'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.2 on 2026-10-18 12:40
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    RecipeToIngredient = apps.get_model('recipes', 'RecipeToIngredient')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    ShoppingCartTotal = apps.get_model('recipes', 'ShoppingCartTotal')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(first_id=Min('id'), rows=Count('id')).filter(rows__gt=1)
+    user_ids = set()
+    for row in duplicates:
+        keep_id = row['first_id']
+        duplicate_ids = list(Ingredient.objects.filter(
+            name=row['name'], measurement_unit=row['measurement_unit']
+        ).exclude(id=keep_id).values_list('id', flat=True))
+        user_ids.update(ShoppingCartTotal.objects.filter(
+            ingredient_id__in=duplicate_ids
+        ).values_list('user_id', flat=True))
+        for relation in RecipeToIngredient.objects.filter(
+            ingredient_id__in=duplicate_ids
+        ):
+            kept = RecipeToIngredient.objects.filter(
+                recipe_id=relation.recipe_id, ingredient_id=keep_id
+            ).first()
+            if kept is None:
+                relation.ingredient_id = keep_id
+                relation.save(update_fields=['ingredient'])
+            else:
+                kept.amount += relation.amount
+                kept.save(update_fields=['amount'])
+                relation.delete()
+        Ingredient.objects.filter(id__in=duplicate_ids).delete()
+    if not user_ids:
+        return
+    ShoppingCartTotal.objects.filter(user_id__in=user_ids).delete()
+    rows = ShoppingCart.objects.filter(
+        user_id__in=user_ids,
+        recipe__recipe_ingridients__isnull=False
+    ).values(
+        'user_id', 'recipe__recipe_ingridients__ingredient_id'
+    ).annotate(total=Sum('recipe__recipe_ingridients__amount'))
+    ShoppingCartTotal.objects.bulk_create(
+        [
+            ShoppingCartTotal(
+                user_id=row['user_id'],
+                ingredient_id=row['recipe__recipe_ingridients__ingredient_id'],
+                amount=row['total'],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_shoppingcart_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_name_unit'),
+        ),
+    ]
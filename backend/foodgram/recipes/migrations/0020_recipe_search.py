@@ -0,0 +1,93 @@
+# Generated by Django 3.2 on 2026-10-18 15:05
+
+from django.db import migrations
+
+# the DDL is frozen here: recipes.search keeps the index in sync after
+# later migrations, changes there must not rewrite this one
+
+POSTGRES_CREATE = (
+    '''
+    ALTER TABLE recipes_recipe ADD COLUMN IF NOT EXISTS search_vector
+    tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(text, '')), 'B')
+    ) STORED
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_idx
+    ON recipes_recipe USING GIN (search_vector)
+    ''',
+)
+POSTGRES_DROP = (
+    'DROP INDEX IF EXISTS recipes_recipe_search_vector_idx',
+    'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector',
+)
+SQLITE_CREATE = (
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_fts USING fts5(
+        name, text, content='recipes_recipe', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_insert
+    AFTER INSERT ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_delete
+    AFTER DELETE ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_update
+    AFTER UPDATE OF name, text ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO recipes_recipe_fts(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    ''',
+    "INSERT INTO recipes_recipe_fts(recipes_recipe_fts) VALUES ('rebuild')",
+)
+SQLITE_DROP = (
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_insert',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_delete',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_update',
+    'DROP TABLE IF EXISTS recipes_recipe_fts',
+)
+
+
+def _execute(schema_editor, statements):
+    with schema_editor.connection.cursor() as cursor:
+        for sql in statements.get(schema_editor.connection.vendor, ()):
+            cursor.execute(sql)
+
+
+def create_search_index(apps, schema_editor):
+    _execute(schema_editor, {
+        'postgresql': POSTGRES_CREATE,
+        'sqlite': SQLITE_CREATE,
+    })
+
+
+def remove_search_index(apps, schema_editor):
+    _execute(schema_editor, {
+        'postgresql': POSTGRES_DROP,
+        'sqlite': SQLITE_DROP,
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_ingredient_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
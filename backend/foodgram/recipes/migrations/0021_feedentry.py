@@ -0,0 +1,89 @@
+# Generated by Django 3.2 on 2026-10-18 16:20
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+import django.db.models.deletion
+
+
+def build_feeds(apps, schema_editor):
+    '''
+    Latest FEED_BACKFILL_LIMIT recipes of every followed author with
+    one ROW_NUMBER() query per batch of authors (the same query as
+    RecipeQuerySet.latest_per_author), fanned out to their subscribers
+    '''
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FeedEntry = apps.get_model('recipes', 'FeedEntry')
+    Subscriptions = apps.get_model('users', 'Subscriptions')
+    subscribers = defaultdict(list)
+    for subscriber_id, author_id in Subscriptions.objects.values_list(
+        'subscriber_id', 'subscription_id'
+    ).iterator():
+        subscribers[author_id].append(subscriber_id)
+    author_ids = list(subscribers)
+    for start in range(0, len(author_ids), 500):
+        ranked = Recipe.objects.filter(
+            author_id__in=author_ids[start:start + 500]
+        ).annotate(
+            recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=F('id').desc()
+            )
+        ).values('id', 'recipe_rank')
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.filter(id__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            'WHERE ranked.recipe_rank <= %s',
+            (*params, settings.FEED_BACKFILL_LIMIT)
+        )).values_list('id', 'author_id')
+        FeedEntry.objects.bulk_create(
+            [
+                FeedEntry(
+                    user_id=subscriber_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                )
+                for recipe_id, author_id in recipes.iterator()
+                for subscriber_id in subscribers[author_id]
+            ],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0020_recipe_search'),
+        ('users', '0007_alter_user_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Лента подписок',
+                'verbose_name_plural': 'Ленты подписок',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', 'author'], name='feed_user_author_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feedentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_user_recipe_feed'),
+        ),
+        migrations.RunPython(build_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2 on 2026-10-18 10:43
+
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def is_rendered(name):
+    '''
+    Frozen copy of recipes.images.get_image_variants as of this
+    migration: the thumbnail, written last, marks a complete set
+    '''
+    path = PurePosixPath(name)
+    thumbnail = (
+        path.parent / 'variants'
+        / f'{path.stem}_{settings.IMAGE_THUMBNAIL_WIDTH}.jpg'
+    )
+    return default_storage.exists(str(thumbnail))
+
+
+def mark_rendered(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    names = Recipe.objects.values_list('image', flat=True).distinct()
+    for name in list(names):
+        if name and is_rendered(name):
+            Recipe.objects.filter(image=name).update(image_variants=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0021_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Картинка с готовыми вариантами'),
+        ),
+        migrations.RunPython(mark_rendered, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,11 @@ from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import (
+    BooleanField, Exists, F, OuterRef, Prefetch, Value, Window
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 from django.conf import settings
 
 User = get_user_model()
@@ -54,11 +59,75 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингридиент'
         verbose_name_plural = 'Ингридиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_name_unit'
+            ),
+        ]
 
     def __str__(self):
         return self.name[:settings.CROP_LEN_TEXT]
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self):
+        '''
+        Load author and the tag / ingredient relation rows in a fixed
+        number of queries regardless of the page size. Tags and
+        ingredients themselves are resolved by the reference registry
+        '''
+        return self.select_related('author').prefetch_related(
+            Prefetch('recipetotag_set', queryset=RecipeToTag.objects.all()),
+            Prefetch(
+                'recipe_ingridients',
+                queryset=RecipeToIngredient.objects.all()
+            ),
+        )
+
+    def latest_per_author(self, author_ids, limit):
+        '''
+        At most limit newest recipes of every author in one query:
+        ROW_NUMBER() partitioned by author in a subquery (Django 3.2
+        can not filter on a window expression directly)
+        '''
+        if not author_ids:
+            return self.none()
+        ranked = Recipe.objects.filter(author_id__in=author_ids).annotate(
+            recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=F('id').desc()
+            )
+        ).values('id', 'recipe_rank')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(id__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            'WHERE ranked.recipe_rank <= %s',
+            (*params, limit)
+        ))
+
+    def with_user_flags(self, user):
+        '''
+        Annotate is_favorited / is_in_shopping_cart for the given user
+        with correlated EXISTS subqueries (constant False for anonymous)
+        '''
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
+
+
 class Recipe(models.Model):
     name = models.CharField(
         'Название',
@@ -72,6 +141,12 @@ class Recipe(models.Model):
         null=False,
         upload_to='ingridients/'
     )
+    image_variants = models.CharField(
+        'Картинка с готовыми вариантами',
+        max_length=100,
+        blank=True,
+        editable=False
+    )
     text = models.TextField(
         'Рецепт',
         blank=False,
@@ -99,6 +174,13 @@ class Recipe(models.Model):
         through='RecipeToTag',
         verbose_name='Теги'
     )
+    updated = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+        db_index=True
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
@@ -188,11 +270,52 @@ class ShoppingCart(models.Model):
     class Meta:
         verbose_name = 'Корзина покупок'
         verbose_name_plural = 'Корзины покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_user_recipe_cart'
+            )
+        ]
 
     def __str__(self):
         return f'{self.user}_{self.recipe} cart'[:settings.CROP_LEN_TEXT]
 
 
+class ShoppingCartTotal(models.Model):
+    '''
+    Materialized ingredient totals of a user's shopping cart,
+    maintained incrementally by recipes.services
+    '''
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shoppingcart_totals'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингридиент'
+    )
+    amount = models.IntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Итог корзины покупок'
+        verbose_name_plural = 'Итоги корзин покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_user_ingredient_total'
+            ),
+        ]
+
+    def __str__(self):
+        return (
+            f'{self.user}_{self.ingredient} '
+            f'{self.amount}'[:settings.CROP_LEN_TEXT]
+        )
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(
         User,
@@ -222,3 +345,47 @@ class Favorite(models.Model):
             f'favorites {self.user.name}_'
             f'{self.recipe.name}'[:settings.CROP_LEN_TEXT]
         )
+
+
+class FeedEntry(models.Model):
+    '''
+    Timeline of a user: recipes of the followed authors, written on
+    recipe creation (fan-out) and on subscribe, see recipes.services
+    '''
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='feed_entries'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='feed_entries'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор',
+        related_name='+'
+    )
+
+    class Meta:
+        verbose_name = 'Лента подписок'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_user_recipe_feed'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_user_author_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user}_{self.recipe} feed'[:settings.CROP_LEN_TEXT]
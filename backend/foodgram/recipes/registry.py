@@ -0,0 +1,98 @@
+import threading
+from collections import namedtuple
+
+from recipes.catalog import get_reference_version
+from recipes.models import Ingredient, Tag
+
+TAG_FIELDS = ('id', 'name', 'color', 'slug')
+INGREDIENT_FIELDS = ('id', 'name', 'measurement_unit')
+
+
+class ReferenceData(
+    namedtuple('ReferenceData', ('tags', 'tag_ids_by_slug', 'ingredients'))
+):
+    '''
+    Snapshot of the reference data. Rows created in another process
+    before the version bump reaches this one are loaded on demand
+    '''
+    __slots__ = ()
+
+    def get_tag(self, pk):
+        if pk not in self.tags:
+            self.tags[pk] = Tag.objects.values(*TAG_FIELDS).get(pk=pk)
+        return dict(self.tags[pk])
+
+    def get_ingredient(self, pk):
+        if pk not in self.ingredients:
+            self.ingredients[pk] = Ingredient.objects.values(
+                *INGREDIENT_FIELDS
+            ).get(pk=pk)
+        return dict(self.ingredients[pk])
+
+
+class ReferenceRegistry:
+    '''
+    Process-level registry of tags and ingredients.
+    Resolves ids/slugs to ready-made dicts (the same shape as
+    TagSerializer / IngredientSerializer output) without a query.
+    Loaded on first use and reloaded when the reference data
+    version changes
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = ReferenceData({}, {}, {})
+
+    def __deepcopy__(self, memo):
+        # filters deep copy their choices callables, keep one registry
+        return self
+
+    def _load(self):
+        tags = {tag['id']: tag for tag in Tag.objects.values(*TAG_FIELDS)}
+        ingredients = {
+            ingredient['id']: ingredient
+            for ingredient in Ingredient.objects.values(*INGREDIENT_FIELDS)
+        }
+        tag_ids_by_slug = {tag['slug']: pk for pk, tag in tags.items()}
+        return ReferenceData(tags, tag_ids_by_slug, ingredients)
+
+    @property
+    def data(self):
+        version = get_reference_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._data = self._load()
+                    self._version = version
+        return self._data
+
+    def get_data(self, request=None):
+        '''
+        Snapshot resolved once per request and cached on it,
+        the version is not read again for every rendered row
+        '''
+        if request is None:
+            return self.data
+        if not hasattr(request, 'reference_data'):
+            request.reference_data = self.data
+        return request.reference_data
+
+    def get_tag(self, pk):
+        return self.data.get_tag(pk)
+
+    def get_tag_ids(self, slugs):
+        tag_ids_by_slug = self.data.tag_ids_by_slug
+        return [tag_ids_by_slug[slug] for slug in slugs]
+
+    def get_tag_choices(self):
+        return [(tag['slug'], tag['name']) for tag in self.data.tags.values()]
+
+    def get_ingredient(self, pk):
+        return self.data.get_ingredient(pk)
+
+    def get_ingredients(self):
+        return self.data.ingredients.values()
+
+
+reference_registry = ReferenceRegistry()
@@ -0,0 +1,156 @@
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# the index lives outside of the models: a generated tsvector column
+# with a GIN index on PostgreSQL, an FTS5 external content table kept
+# in sync by triggers on SQLite. Both follow every write to
+# recipes_recipe, including bulk inserts and queryset updates
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+SEARCH_WORD = re.compile(r'\w+')
+NAME_WEIGHT = 10.0
+TEXT_WEIGHT = 1.0
+
+POSTGRES_CREATE = (
+    f'''
+    ALTER TABLE recipes_recipe ADD COLUMN IF NOT EXISTS search_vector
+    tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(text, '')), 'B')
+    ) STORED
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_idx
+    ON recipes_recipe USING GIN (search_vector)
+    ''',
+)
+POSTGRES_DROP = (
+    'DROP INDEX IF EXISTS recipes_recipe_search_vector_idx',
+    'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector',
+)
+SQLITE_CREATE = (
+    f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, text, content='recipes_recipe', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+    AFTER INSERT ON recipes_recipe BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+    AFTER DELETE ON recipes_recipe BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF name, text ON recipes_recipe BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    ''',
+)
+SQLITE_DROP = (
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_delete',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_update',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+)
+
+
+def _sqlite_triggers(cursor):
+    cursor.execute(
+        "SELECT count(*) FROM sqlite_master "
+        "WHERE type = 'trigger' AND name LIKE %s",
+        [f'{FTS_TABLE}_%'],
+    )
+    return cursor.fetchone()[0]
+
+
+def ensure_search_index(connection):
+    '''
+    Idempotent, also called after every migrate: SQLite drops the
+    triggers when a migration rebuilds recipes_recipe, the FTS table
+    is then recreated from the recipes
+    '''
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRES_CREATE:
+                cursor.execute(sql)
+        elif connection.vendor == 'sqlite':
+            complete = _sqlite_triggers(cursor) == 3
+            for sql in SQLITE_CREATE:
+                cursor.execute(sql)
+            if not complete:
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+                )
+
+
+def drop_search_index(connection):
+    statements = {
+        'postgresql': POSTGRES_DROP,
+        'sqlite': SQLITE_DROP,
+    }.get(connection.vendor, ())
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def search_recipes(queryset, query):
+    '''
+    Filter recipes by the words of the query, best matches first.
+    Matches in the name weigh more than matches in the text
+    '''
+    words = SEARCH_WORD.findall(query)
+    if not words:
+        return queryset
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        queryset = queryset.filter(id__in=RawSQL(
+            f'SELECT id FROM recipes_recipe '
+            f'WHERE search_vector @@ {tsquery}',
+            (query, )
+        )).annotate(search_rank=RawSQL(
+            f'ts_rank(recipes_recipe.search_vector, {tsquery})',
+            (query, ),
+            output_field=FloatField()
+        ))
+    elif vendor == 'sqlite':
+        match = ' '.join(f'"{word}"*' for word in words)
+        # a join, not a correlated subquery: MATCH runs once and bm25
+        # is read from the matched row of the FTS cursor
+        queryset = queryset.extra(
+            select={'search_rank': (
+                f'-bm25({FTS_TABLE}, {NAME_WEIGHT}, {TEXT_WEIGHT})'
+            )},
+            tables=[FTS_TABLE],
+            where=[
+                f'{FTS_TABLE} MATCH %s',
+                f'{FTS_TABLE}.rowid = recipes_recipe.id',
+            ],
+            params=[match],
+        )
+    else:
+        for word in words:
+            queryset = queryset.filter(
+                Q(name__icontains=word) | Q(text__icontains=word)
+            )
+        queryset = queryset.annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+    return queryset.order_by('-search_rank', '-id')
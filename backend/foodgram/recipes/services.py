@@ -0,0 +1,304 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from recipes.models import (
+    FeedEntry, Recipe, RecipeToIngredient, RecipeToTag, ShoppingCart,
+    ShoppingCartTotal
+)
+from users.models import Subscriptions
+
+BULK_BATCH_SIZE = 1000
+
+
+def get_recipe_amounts(recipe_id):
+    return dict(
+        RecipeToIngredient.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount')
+    )
+
+
+def mark_image_variants(name):
+    '''
+    Serve the rendered variants of the image. Recipe.updated is
+    touched, so etags of the recipes change with thumbnail / srcset
+    '''
+    Recipe.objects.filter(image=name).exclude(image_variants=name).update(
+        image_variants=name,
+        updated=timezone.now()
+    )
+
+
+@transaction.atomic
+def change_cart_totals(user_ids, amounts, sign=1):
+    '''
+    Add (sign=1) or subtract (sign=-1) ingredient amounts
+    {ingredient_id: amount} of a recipe to the cart totals of users.
+    An upsert: missing rows are inserted empty with ignore_conflicts,
+    then every row is changed in place, so concurrent adds of the same
+    ingredient never collide on unique_user_ingredient_total
+    '''
+    if not user_ids or not amounts:
+        return
+    if sign > 0:
+        ShoppingCartTotal.objects.bulk_create(
+            [
+                ShoppingCartTotal(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    amount=0
+                )
+                for user_id in user_ids
+                for ingredient_id in amounts
+            ],
+            batch_size=BULK_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+    for ingredient_id, amount in amounts.items():
+        ShoppingCartTotal.objects.filter(
+            user_id__in=user_ids,
+            ingredient_id=ingredient_id
+        ).update(amount=F('amount') + sign * amount)
+    ShoppingCartTotal.objects.filter(
+        user_id__in=user_ids,
+        amount__lte=0
+    ).delete()
+
+
+def add_recipe_to_totals(user_id, recipe_id):
+    change_cart_totals([user_id], get_recipe_amounts(recipe_id), 1)
+
+
+def remove_recipe_from_totals(user_id, recipe_id):
+    change_cart_totals([user_id], get_recipe_amounts(recipe_id), -1)
+
+
+def remove_recipe_from_all_carts(recipe_id):
+    user_ids = list(
+        ShoppingCart.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('user_id', flat=True)
+    )
+    change_cart_totals(user_ids, get_recipe_amounts(recipe_id), -1)
+
+
+def aggregate_cart_totals(user_ids=None):
+    ''' {(user_id, ingredient_id): amount} computed from the carts '''
+    carts = ShoppingCart.objects.filter(
+        recipe__recipe_ingridients__isnull=False
+    )
+    if user_ids is not None:
+        carts = carts.filter(user_id__in=user_ids)
+    rows = carts.values(
+        'user_id', 'recipe__recipe_ingridients__ingredient_id'
+    ).annotate(
+        total=Sum('recipe__recipe_ingridients__amount')
+    ).values_list(
+        'user_id', 'recipe__recipe_ingridients__ingredient_id', 'total'
+    )
+    return {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in rows.iterator()
+    }
+
+
+def _stored_cart_totals(user_ids=None):
+    totals = ShoppingCartTotal.objects.all()
+    if user_ids is not None:
+        totals = totals.filter(user_id__in=user_ids)
+    return {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in totals.values_list(
+            'user_id', 'ingredient_id', 'amount'
+        ).iterator()
+    }
+
+
+@transaction.atomic
+def rebuild_cart_totals(user_ids=None):
+    ''' recompute totals of the given users (all users for None) '''
+    totals = aggregate_cart_totals(user_ids)
+    stored = ShoppingCartTotal.objects.all()
+    if user_ids is not None:
+        stored = stored.filter(user_id__in=user_ids)
+    stored.delete()
+    ShoppingCartTotal.objects.bulk_create(
+        (
+            ShoppingCartTotal(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                amount=amount
+            )
+            for (user_id, ingredient_id), amount in totals.items()
+        ),
+        batch_size=BULK_BATCH_SIZE
+    )
+    return len(totals)
+
+
+def verify_cart_totals(user_ids=None):
+    ''' ids of users whose stored totals differ from their carts '''
+    expected = aggregate_cart_totals(user_ids)
+    stored = _stored_cart_totals(user_ids)
+    return {
+        user_id
+        for user_id, ingredient_id in expected.keys() | stored.keys()
+        if expected.get((user_id, ingredient_id))
+        != stored.get((user_id, ingredient_id))
+    }
+
+
+def refresh_recipe_carts(recipe_id):
+    ''' recipe ingredients changed: rebuild the carts containing it '''
+    user_ids = set(
+        ShoppingCart.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('user_id', flat=True)
+    )
+    if user_ids:
+        rebuild_cart_totals(user_ids)
+
+
+def _delete_rows(model, ids):
+    '''
+    One DELETE ... WHERE id IN statement. queryset.delete() would
+    send post_delete for every row, and the receivers of the relation
+    models touch the recipe and rebuild the carts of its users once
+    per row. Callers save the recipe (touch + catalog bump) and refresh
+    the carts once themselves
+    '''
+    ids = list(ids)
+    if not ids:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    for start in range(0, len(ids), BULK_BATCH_SIZE):
+        batch = ids[start:start + BULK_BATCH_SIZE]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE id IN '
+                f'({", ".join(["%s"] * len(batch))})',
+                batch
+            )
+
+
+@transaction.atomic(savepoint=False)
+def sync_recipe_ingredients(recipe, amounts):
+    '''
+    Apply {ingredient_id: amount} as a delta against the current rows:
+    at most one delete, one update and one insert.
+    Returns True when the ingredients changed
+    '''
+    current = {
+        row.ingredient_id: row
+        for row in RecipeToIngredient.objects.filter(recipe=recipe)
+    }
+    removed = [
+        row.id for ingredient_id, row in current.items()
+        if ingredient_id not in amounts
+    ]
+    changed = []
+    for ingredient_id, row in current.items():
+        amount = amounts.get(ingredient_id)
+        if amount is not None and row.amount != amount:
+            row.amount = amount
+            changed.append(row)
+    added = [
+        RecipeToIngredient(
+            recipe=recipe, ingredient_id=ingredient_id, amount=amount
+        )
+        for ingredient_id, amount in amounts.items()
+        if ingredient_id not in current
+    ]
+    _delete_rows(RecipeToIngredient, removed)
+    if changed:
+        RecipeToIngredient.objects.bulk_update(
+            changed, ['amount'], batch_size=BULK_BATCH_SIZE
+        )
+    if added:
+        RecipeToIngredient.objects.bulk_create(
+            added, batch_size=BULK_BATCH_SIZE
+        )
+    return bool(removed or changed or added)
+
+
+@transaction.atomic(savepoint=False)
+def sync_recipe_tags(recipe, tag_ids):
+    ''' same for tags: at most one delete and one insert '''
+    tag_ids = set(tag_ids)
+    current = dict(
+        RecipeToTag.objects.filter(
+            recipe=recipe
+        ).values_list('tag_id', 'id')
+    )
+    _delete_rows(RecipeToTag, [
+        row_id for tag_id, row_id in current.items()
+        if tag_id not in tag_ids
+    ])
+    if tag_ids - current.keys():
+        RecipeToTag.objects.bulk_create([
+            RecipeToTag(recipe=recipe, tag_id=tag_id)
+            for tag_id in tag_ids - current.keys()
+        ])
+    return current.keys() != tag_ids
+
+
+def fan_out_recipes(recipes):
+    '''
+    Put new recipes [(id, author_id)] into the feeds of followers.
+    One INSERT ... SELECT joined with the subscriptions per batch: a
+    subscription deleted meanwhile adds no rows. Its rows are locked
+    where the database supports it, so an unsubscribe that commits
+    later waits and removes the rows inserted here
+    '''
+    recipe_ids = [recipe_id for recipe_id, _ in recipes]
+    feed = FeedEntry._meta
+    columns = ', '.join(
+        connection.ops.quote_name(feed.get_field(name).column)
+        for name in ('user', 'recipe', 'author')
+    )
+    for start in range(0, len(recipe_ids), BULK_BATCH_SIZE):
+        with transaction.atomic():
+            followers = Subscriptions.objects.filter(
+                subscription__recipes__id__in=recipe_ids[
+                    start:start + BULK_BATCH_SIZE
+                ]
+            ).select_for_update(of=('self', )).values_list(
+                'subscriber_id', 'subscription__recipes__id', 'subscription_id'
+            )
+            sql, params = followers.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    '{} {} ({}) {} {}'.format(
+                        connection.ops.insert_statement(ignore_conflicts=True),
+                        connection.ops.quote_name(feed.db_table),
+                        columns,
+                        sql,
+                        connection.ops.ignore_conflicts_suffix_sql(
+                            ignore_conflicts=True
+                        )
+                    ),
+                    params
+                )
+
+
+def backfill_feed(user_id, author_ids):
+    ''' latest FEED_BACKFILL_LIMIT recipes of new subscriptions '''
+    recipes = Recipe.objects.latest_per_author(
+        author_ids, settings.FEED_BACKFILL_LIMIT
+    ).values_list('id', 'author_id')
+    FeedEntry.objects.bulk_create(
+        [
+            FeedEntry(user_id=user_id, recipe_id=recipe_id, author_id=author)
+            for recipe_id, author in recipes
+        ],
+        batch_size=BULK_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def remove_from_feed(user_id, author_ids):
+    FeedEntry.objects.filter(
+        user_id=user_id, author_id__in=author_ids
+    ).delete()
@@ -0,0 +1,130 @@
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_migrate, post_save, pre_delete
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from recipes.catalog import bump_catalog_version, bump_reference_version
+from recipes.images import schedule_image_variants
+from recipes.search import ensure_search_index
+from recipes.models import (
+    Ingredient, Recipe, RecipeToIngredient, RecipeToTag, ShoppingCart, Tag
+)
+from recipes.services import (
+    add_recipe_to_totals, fan_out_recipes, mark_image_variants,
+    refresh_recipe_carts, remove_recipe_from_all_carts
+)
+
+User = get_user_model()
+
+CATALOG_MODELS = (Recipe, RecipeToIngredient, RecipeToTag, Tag, Ingredient)
+REFERENCE_MODELS = (Tag, Ingredient)
+RECIPE_RELATION_MODELS = (RecipeToIngredient, RecipeToTag)
+SEARCH_MIGRATION = '0020_recipe_search'
+
+
+def catalog_changed(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+def reference_changed(sender, **kwargs):
+    transaction.on_commit(bump_reference_version)
+
+
+def touch_recipes(recipe_ids):
+    ''' keep Recipe.updated in sync with changes of its relations '''
+    Recipe.objects.filter(pk__in=recipe_ids).update(updated=timezone.now())
+
+
+def recipe_relation_changed(sender, instance, **kwargs):
+    touch_recipes([instance.recipe_id])
+
+
+def recipe_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    catalog_changed(sender)
+    if not reverse:
+        touch_recipes([instance.pk])
+    elif pk_set:
+        touch_recipes(pk_set)
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model)
+    post_delete.connect(catalog_changed, sender=model)
+
+for model in REFERENCE_MODELS:
+    post_save.connect(reference_changed, sender=model)
+    post_delete.connect(reference_changed, sender=model)
+
+for model in RECIPE_RELATION_MODELS:
+    post_save.connect(recipe_relation_changed, sender=model)
+    post_delete.connect(recipe_relation_changed, sender=model)
+
+m2m_changed.connect(recipe_m2m_changed, sender=Recipe.tags.through)
+m2m_changed.connect(recipe_m2m_changed, sender=Recipe.ingredients.through)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, update_fields=None, **kwargs):
+    ''' authors are embedded into recipes, login only touches last_login '''
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    catalog_changed(sender, **kwargs)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def recipe_added_to_cart(sender, instance, created, **kwargs):
+    if created:
+        add_recipe_to_totals(instance.user_id, instance.recipe_id)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(sender, instance, **kwargs):
+    ''' variants of a new image are rendered after the commit '''
+    name = instance.image.name
+    if instance.image_variants == name:
+        return
+    transaction.on_commit(
+        lambda: schedule_image_variants(name, mark_image_variants)
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    ''' fan-out to the feeds of the author's followers '''
+    if created:
+        recipes = [(instance.id, instance.author_id)]
+        transaction.on_commit(lambda: fan_out_recipes(recipes))
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    '''
+    Cart rows go away with the recipe. Removal from a cart in the api
+    updates totals explicitly, so ShoppingCart has no delete receivers
+    and its deletes stay single statements
+    '''
+    remove_recipe_from_all_carts(instance.id)
+
+
+@receiver(post_save, sender=RecipeToIngredient)
+@receiver(post_delete, sender=RecipeToIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    recipe_id = instance.recipe_id
+    transaction.on_commit(lambda: refresh_recipe_carts(recipe_id))
+
+
+@receiver(post_migrate)
+def recipes_migrated(sender, using, **kwargs):
+    ''' the search index is outside of the models, see recipes.search '''
+    if sender.name != 'recipes':
+        return
+    connection = connections[using]
+    applied = MigrationRecorder(connection).applied_migrations()
+    if ('recipes', SEARCH_MIGRATION) in applied:
+        ensure_search_index(connection)
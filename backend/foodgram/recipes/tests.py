@@ -0,0 +1,220 @@
+import json
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from recipes.catalog import bump_catalog_version
+from recipes.indexes import PantryIndex
+from recipes.models import (
+    Ingredient, Recipe, RecipeToIngredient, ShoppingCartTotal, Tag
+)
+from recipes.services import change_cart_totals
+
+User = get_user_model()
+
+
+class PantryIndexTests(TestCase):
+    ''' "what can I cook" ranking of the inverted ingredient index '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            password='password',
+            first_name='Имя',
+            last_name='Фамилия',
+        )
+        cls.egg, cls.milk, cls.flour, cls.salt = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('яйцо', 'молоко', 'мука', 'соль')
+        )
+        cls.omelette = cls._create_recipe((cls.egg, cls.milk))
+        cls.pancakes = cls._create_recipe(
+            (cls.egg, cls.milk, cls.flour, cls.salt)
+        )
+        cls.boiled_egg = cls._create_recipe((cls.egg, ))
+
+    @classmethod
+    def _create_recipe(cls, ingredients):
+        recipe = Recipe.objects.create(
+            author=cls.author,
+            name='Рецепт',
+            image='ingridients/test.png',
+            text='Текст',
+            cooking_time=5,
+        )
+        RecipeToIngredient.objects.bulk_create(
+            RecipeToIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in ingredients
+        )
+        return recipe
+
+    def setUp(self):
+        self.index = PantryIndex()
+
+    def _rank(self, ingredients, max_missing=None):
+        return self.index.rank(
+            [ingredient.id for ingredient in ingredients], max_missing
+        ).tolist()
+
+    def test_rank_fewest_missing_first(self):
+        self.assertEqual(
+            self._rank((self.egg, self.milk)),
+            [self.omelette.id, self.boiled_egg.id, self.pancakes.id]
+        )
+
+    def test_rank_max_missing(self):
+        self.assertEqual(
+            self._rank((self.egg, self.milk), max_missing=0),
+            [self.omelette.id, self.boiled_egg.id]
+        )
+        self.assertEqual(
+            self._rank((self.flour, ), max_missing=2), []
+        )
+        self.assertEqual(
+            self._rank((self.flour, self.salt), max_missing=2),
+            [self.pancakes.id]
+        )
+
+    def test_refresh_after_recipe_update(self):
+        self._rank((self.egg, ))
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeToIngredient.objects.filter(
+                recipe=self.pancakes, ingredient__in=(self.flour, self.salt)
+            ).delete()
+            RecipeToIngredient.objects.create(
+                recipe=self.boiled_egg, ingredient=self.salt, amount=1
+            )
+        self.assertEqual(
+            self._rank((self.egg, self.milk), max_missing=0),
+            [self.pancakes.id, self.omelette.id]
+        )
+        self.assertEqual(
+            self._rank((self.salt, )), [self.boiled_egg.id]
+        )
+
+    def test_refresh_after_bulk_insert(self):
+        self._rank((self.egg, ))
+        recipes = [
+            self._create_recipe((self.milk, )) for _ in range(3)
+        ]
+        bump_catalog_version()
+        self.assertEqual(
+            self._rank((self.milk, ), max_missing=0),
+            [recipe.id for recipe in reversed(recipes)]
+        )
+        self.assertEqual(
+            self._rank((self.egg, self.milk), max_missing=0),
+            [
+                self.omelette.id,
+                *(recipe.id for recipe in reversed(recipes)),
+                self.boiled_egg.id,
+            ]
+        )
+
+
+class CartTotalsTests(TestCase):
+    ''' incremental ingredient totals of shopping carts '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user',
+            email='user@example.com',
+            password='password',
+            first_name='Имя',
+            last_name='Фамилия',
+        )
+        cls.egg, cls.milk = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('яйцо', 'молоко')
+        )
+
+    def _totals(self):
+        return dict(
+            ShoppingCartTotal.objects.filter(
+                user=self.user
+            ).values_list('ingredient_id', 'amount')
+        )
+
+    def test_add_and_remove(self):
+        amounts = {self.egg.id: 2, self.milk.id: 100}
+        change_cart_totals([self.user.id], amounts)
+        change_cart_totals([self.user.id], {self.egg.id: 3})
+        self.assertEqual(
+            self._totals(), {self.egg.id: 5, self.milk.id: 100}
+        )
+        change_cart_totals([self.user.id], amounts, -1)
+        self.assertEqual(self._totals(), {self.egg.id: 3})
+        change_cart_totals([self.user.id], {self.egg.id: 3}, -1)
+        self.assertEqual(self._totals(), {})
+
+
+class ImportRecipesTests(TestCase):
+    ''' import_recipes skips invalid records and reports them '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author',
+            email='author@example.com',
+            password='password',
+            first_name='Имя',
+            last_name='Фамилия',
+        )
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        Ingredient.objects.create(name='яйцо', measurement_unit='шт')
+
+    def _record(self, name, ingredient_name='яйцо', tags=('breakfast', )):
+        return {
+            'name': name,
+            'text': 'Текст',
+            'cooking_time': 5,
+            'image': 'recipes/images/test.png',
+            'tags': list(tags),
+            'ingredients': [{'name': ingredient_name, 'amount': 2}],
+        }
+
+    def _import(self, lines):
+        file = tempfile.NamedTemporaryFile(
+            'w', suffix='.ndjson', encoding='utf-8'
+        )
+        self.addCleanup(file.close)
+        file.write('\n'.join(lines))
+        file.flush()
+        stderr = StringIO()
+        call_command(
+            'import_recipes',
+            path=file.name,
+            author=self.author.email,
+            stdout=StringIO(),
+            stderr=stderr,
+        )
+        return stderr.getvalue().splitlines()
+
+    def test_invalid_records_reported_with_line_numbers(self):
+        missing_name = self._record('Без названия ингредиента')
+        del missing_name['ingredients'][0]['name']
+        errors = self._import([
+            json.dumps(self._record('Омлет')),
+            json.dumps(missing_name),
+            json.dumps(self._record('Число', ingredient_name=5)),
+            '',
+            json.dumps(self._record('Ужин', tags=('dinner', ))),
+            json.dumps(['не', 'объект']),
+            json.dumps(self._record('Яичница')),
+        ])
+        self.assertEqual(errors, [
+            'Line 2 skipped: ingredient 1: name must be a non-empty string',
+            'Line 3 skipped: ingredient 1: name must be a non-empty string',
+            'Line 5 skipped: unknown tags dinner',
+            'Line 6 skipped: record must be an object',
+        ])
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('name', flat=True)),
+            ['Омлет', 'Яичница']
+        )
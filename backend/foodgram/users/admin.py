@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
+from django.db import transaction
 
+from recipes.services import backfill_feed, remove_from_feed
 from users.models import Subscriptions
 
 User = get_user_model()
@@ -19,6 +21,26 @@ class SubscriptionAdmin(admin.ModelAdmin):
     search_fields = ('subscriber', 'subscription',)
     empty_value_display = '-пусто-'
 
+    def save_model(self, request, obj, form, change):
+        if change:
+            old = Subscriptions.objects.get(pk=obj.pk)
+            remove_from_feed(old.subscriber_id, [old.subscription_id])
+        super().save_model(request, obj, form, change)
+        backfill_feed(obj.subscriber_id, [obj.subscription_id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        remove_from_feed(obj.subscriber_id, [obj.subscription_id])
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        subscriptions = list(
+            queryset.values_list('subscriber_id', 'subscription_id')
+        )
+        super().delete_queryset(request, queryset)
+        for subscriber_id, subscription_id in subscriptions:
+            remove_from_feed(subscriber_id, [subscription_id])
+
 
 admin.site.register(User, UserAdmin)
 admin.site.register(Subscriptions, SubscriptionAdmin)
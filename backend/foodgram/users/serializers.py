@@ -1,12 +1,18 @@
-import base64
+import binascii
 
+from django.conf import settings as django_settings
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from djoser.conf import settings
-from django.core.files.base import ContentFile
 from djoser.serializers import UserSerializer
+from PIL import Image
 from rest_framework import serializers
 
-from users.models import Subscriptions
+from users.utils import (
+    base64_decoded_size, decode_base64_file, get_image_pixels,
+    get_recipes_limit, get_subscription_ids
+)
+from recipes.images import get_variant_names
 from recipes.models import Recipe
 
 User = get_user_model()
@@ -40,45 +46,117 @@ class CustomUserSerializer(serializers.ModelSerializer):
         if request:
             current_user = request.user
             if current_user != obj and current_user.is_authenticated:
-                return Subscriptions.objects.filter(
-                    subscriber=current_user,
-                    subscription=obj
-                ).exists()
+                return obj.id in get_subscription_ids(request)
         return False
 
 
+class AuthorIdsSerializer(serializers.Serializer):
+    authors = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False
+    )
+
+
 class Base64ImageField(serializers.ImageField):
+    '''
+    Image from a data:image/<ext>;base64,<data> string or from a
+    multipart/form-data file. Size and pixel limits are checked before
+    the image is decoded by Pillow
+    '''
+    default_error_messages = {
+        'too_large': 'Image size exceeds {max_bytes} bytes.',
+        'too_many_pixels': 'Image exceeds {max_pixels} pixels.',
+        'invalid_base64': 'Invalid base64 image data.',
+    }
+
+    def _check_size(self, size):
+        max_bytes = django_settings.IMAGE_UPLOAD_MAX_BYTES
+        if size > max_bytes:
+            self.fail('too_large', max_bytes=max_bytes)
+
+    def _check_pixels(self, file):
+        max_pixels = django_settings.IMAGE_UPLOAD_MAX_PIXELS
+        try:
+            pixels = get_image_pixels(file)
+        except Image.DecompressionBombError:
+            # header beyond Pillow's own limit (2 * MAX_IMAGE_PIXELS)
+            self.fail('too_many_pixels', max_pixels=max_pixels)
+        except (OSError, ValueError):
+            self.fail('invalid_image')
+        if pixels > max_pixels:
+            self.fail('too_many_pixels', max_pixels=max_pixels)
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            try:
+                format, imgstr = data.split(';base64,', 1)
+                ext = format.split('/')[-1]
+                self._check_size(base64_decoded_size(imgstr))
+                data = decode_base64_file(imgstr, name='temp.' + ext)
+            except (binascii.Error, ValueError):
+                self.fail('invalid_base64')
+        elif hasattr(data, 'size'):
+            self._check_size(data.size)
+        if hasattr(data, 'seek'):
+            self._check_pixels(data)
         return super().to_internal_value(data)
 
 
+class ImageVariantField(serializers.ReadOnlyField):
+    '''
+    Url of the recipe image thumbnail (variant='thumbnail') or srcset
+    of its webp variants (variant='srcset'). The original image is
+    returned while the variants are processing
+    '''
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def _get_url(self, name):
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def to_representation(self, recipe):
+        name = recipe.image.name
+        if not name:
+            return None
+        if recipe.image_variants != name:
+            return self._get_url(name)
+        variants = get_variant_names(name)
+        if self.variant == 'thumbnail':
+            return self._get_url(variants['thumbnail'])
+        return ', '.join(
+            f'{self._get_url(name)} {width}w'
+            for width, name in variants['srcset']
+        )
+
+
 class FilterRecipesSerializer(serializers.ListSerializer):
     ''' customization ListSerializer (many=true) behaviour
         more info https://www.django-rest-framework.org/api-guide/serializers/
     '''
     def to_representation(self, data):
         request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        try:
-            recipes_limit = int(recipes_limit)
-        except (ValueError, TypeError):
-            return super().to_representation(data)
-        if recipes_limit > 0:
+        recipes_limit = get_recipes_limit(request)
+        if recipes_limit:
             data = data.all()[:recipes_limit]
         return super().to_representation(data)
 
 
 class RecipeSerializer(serializers.ModelSerializer):
     image = Base64ImageField(required=True, allow_null=False)
+    thumbnail = ImageVariantField('thumbnail')
+    srcset = ImageVariantField('srcset')
 
     class Meta:
         list_serializer_class = FilterRecipesSerializer
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'thumbnail', 'srcset',
+                  'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
 
 
@@ -98,4 +176,6 @@ class SubscriptionUserSerializer(UserSerializer):
         )
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.all().count()
@@ -0,0 +1,46 @@
+import warnings
+
+from django.contrib.auth import get_user_model
+from rest_framework.test import APITestCase
+
+from users.models import Subscriptions
+
+User = get_user_model()
+
+
+class SubscriptionsListTests(APITestCase):
+    ''' paginated list of followed authors '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscriber, *cls.authors = (
+            User.objects.create_user(
+                username=username,
+                email=f'{username}@example.com',
+                password='password',
+                first_name='Имя',
+                last_name='Фамилия',
+            )
+            for username in ('subscriber', 'anna', 'boris', 'vera')
+        )
+        Subscriptions.objects.bulk_create(
+            Subscriptions(subscriber=cls.subscriber, subscription=author)
+            for author in cls.authors
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.subscriber)
+
+    def test_pages_follow_user_ordering(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            pages = [
+                self.client.get(
+                    '/api/users/subscriptions/', {'limit': 2, 'page': page}
+                ).data['results']
+                for page in (1, 2)
+            ]
+        self.assertEqual(
+            [user['username'] for page in pages for user in page],
+            ['vera', 'boris', 'anna']
+        )
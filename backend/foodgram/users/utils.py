@@ -0,0 +1,73 @@
+import base64
+import binascii
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from PIL import Image
+
+from users.models import Subscriptions
+
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+def get_subscription_ids(request):
+    '''
+    Return IDs of authors followed by the current user.
+    Loaded once and cached on the request, so every is_subscribed
+    of the response is answered from memory
+    '''
+    if not request.user.is_authenticated:
+        return set()
+    if not hasattr(request, 'subscription_ids'):
+        request.subscription_ids = set(
+            Subscriptions.objects.filter(
+                subscriber=request.user
+            ).values_list('subscription_id', flat=True)
+        )
+    return request.subscription_ids
+
+
+def get_recipes_limit(request):
+    ''' positive ?recipes_limit= value or None '''
+    try:
+        recipes_limit = int(request.query_params.get('recipes_limit'))
+    except (ValueError, TypeError):
+        return None
+    if recipes_limit > 0:
+        return recipes_limit
+    return None
+
+
+def decode_base64_file(data, name):
+    '''
+    Decode a base64 string chunk by chunk into a spooled temporary
+    file, large images go to disk instead of worker memory.
+    Raises binascii.Error for malformed data
+    '''
+    file = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+    )
+    for start in range(0, len(data), BASE64_CHUNK_SIZE):
+        file.write(base64.b64decode(
+            data[start:start + BASE64_CHUNK_SIZE], validate=True
+        ))
+    file.seek(0)
+    return File(file, name=name)
+
+
+def base64_decoded_size(data):
+    ''' size of the decoded data, known before decoding '''
+    if len(data) % 4:
+        raise binascii.Error('Incorrect padding')
+    return len(data) // 4 * 3 - data[-2:].count('=')
+
+
+def get_image_pixels(file):
+    ''' width * height from the image header, pixels are not loaded '''
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    finally:
+        file.seek(0)
+    return width * height
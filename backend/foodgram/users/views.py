@@ -1,4 +1,6 @@
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Prefetch, prefetch_related_objects
 from django.shortcuts import get_object_or_404
 from djoser.serializers import UserCreateSerializer
 from rest_framework import viewsets
@@ -7,9 +9,12 @@ from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from recipes.models import Recipe
+from recipes.services import backfill_feed, remove_from_feed
 from users.models import Subscriptions
-from users.serializers import SubscriptionUserSerializer
+from users.serializers import AuthorIdsSerializer, SubscriptionUserSerializer
 from users.serializers import CustomUserSerializer
+from users.utils import get_recipes_limit
 
 
 User = get_user_model()
@@ -43,6 +48,18 @@ class SubscriptionUserViewSet(viewsets.ModelViewSet):
         )
         return Response(serializer.data)
 
+    def _prefetch_recipes(self, request, authors):
+        ''' recipes of all authors in one query, limited per author '''
+        recipes = Recipe.objects.order_by('-id')
+        recipes_limit = get_recipes_limit(request)
+        if recipes_limit:
+            recipes = recipes.latest_per_author(
+                [user.id for user in authors], recipes_limit
+            )
+        prefetch_related_objects(
+            authors, Prefetch('recipes', queryset=recipes)
+        )
+
     @action(
         detail=False,
         methods=['GET', ],
@@ -52,8 +69,11 @@ class SubscriptionUserViewSet(viewsets.ModelViewSet):
     def subscriptions(self, request):
         subscription = User.objects.filter(
             subscription__subscriber=request.user
-        )
+        ).annotate(
+            recipes_count=Count('recipes')
+        ).order_by(*User._meta.ordering, 'id')
         page = self.paginate_queryset(subscription)
+        self._prefetch_recipes(request, page)
         serializer = SubscriptionUserSerializer(
             page,
             many=True,
@@ -68,38 +88,91 @@ class SubscriptionUserViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated, ]
     )
     def subscribe(self, request, pk=None):
-        user = get_object_or_404(User, pk=pk)
-        if request.user == user:
+        if str(request.user.pk) == str(pk):
             return Response(
                 {'errors': 'You can not subscribe/unsubscribe yourself'},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        subscription = Subscriptions.objects.filter(
-            subscriber=request.user,
-            subscription=user
-        ).first()
         if request.method == 'POST':
-            serializer = SubscriptionUserSerializer(
-                instance=user,
-                context={'request': request}
-            )
-            if subscription:
+            user = get_object_or_404(User, pk=pk)
+            try:
+                with transaction.atomic():
+                    Subscriptions.objects.create(
+                        subscriber=request.user,
+                        subscription=user
+                    )
+                    backfill_feed(request.user.id, [user.id])
+            except IntegrityError:
                 return Response(
                     {'errors': 'Subscription already exist'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            Subscriptions.objects.create(
-                subscriber=request.user,
-                subscription=user
+            serializer = SubscriptionUserSerializer(
+                instance=user,
+                context={'request': request}
             )
             return Response(
                 serializer.data,
                 status=status.HTTP_201_CREATED
             )
-        if not subscription:
+        with transaction.atomic():
+            deleted, _ = Subscriptions.objects.filter(
+                subscriber=request.user,
+                subscription_id=pk
+            ).delete()
+            if deleted:
+                remove_from_feed(request.user.id, [pk])
+        if not deleted:
             return Response(
                 {'errors': 'Subscription does not exist'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        subscription.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='subscribe',
+        permission_classes=[IsAuthenticated, ]
+    )
+    def subscribe_batch(self, request):
+        ''' subscribe to / unsubscribe from many authors at once '''
+        serializer = AuthorIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        author_ids = set(serializer.validated_data['authors'])
+        author_ids.discard(request.user.pk)
+        if request.method == 'DELETE':
+            with transaction.atomic():
+                Subscriptions.objects.filter(
+                    subscriber=request.user,
+                    subscription_id__in=author_ids
+                ).delete()
+                remove_from_feed(request.user.id, author_ids)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        authors = list(
+            User.objects.filter(id__in=author_ids).annotate(
+                recipes_count=Count('recipes')
+            )
+        )
+        missing = author_ids - {author.id for author in authors}
+        if missing:
+            return Response(
+                {'errors': f'Users do not exist: {sorted(missing)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        with transaction.atomic():
+            Subscriptions.objects.bulk_create(
+                [
+                    Subscriptions(subscriber=request.user, subscription=author)
+                    for author in authors
+                ],
+                ignore_conflicts=True
+            )
+            backfill_feed(request.user.id, author_ids)
+        self._prefetch_recipes(request, authors)
+        serializer = SubscriptionUserSerializer(
+            authors,
+            many=True,
+            context={'request': request}
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)